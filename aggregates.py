@@ -0,0 +1,282 @@
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.orm import Session
+from models import SensorReading, SensorRollup
+from sensor_queries import apply_sensor_filters
+from partitions import partition_scope
+from rollups import RESOLUTIONS, ROLLUP_MODE, rollup_resolution_for
+from retention import tier_segments, rollup_for_bucket
+from archive import has_chunks, iter_archived
+
+# Tamaños de bucket soportados, en segundos
+BUCKETS = {"1m": 60, "5m": 300, "15m": 900, "1h": 3600, "1d": 86400}
+MAX_BUCKETS = 10000
+DEFAULT_RANGE = timedelta(days=1)
+EPOCH = datetime(1970, 1, 1)
+
+
+# recorded_at se guarda en UTC sin zona: un from/to con zona (?from=...Z) se pasa a UTC
+def _utc_naive(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def resolve_range(bucket: str, from_: datetime = None, to: datetime = None):
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Invalid bucket. Must be one of: {', '.join(BUCKETS)}")
+    from_, to = _utc_naive(from_), _utc_naive(to)
+    to = to or datetime.utcnow()
+    from_ = from_ or to - DEFAULT_RANGE
+    if from_ >= to:
+        raise HTTPException(status_code=400, detail="'from' must be earlier than 'to'")
+    if (to - from_).total_seconds() / BUCKETS[bucket] > MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Range too large for this bucket size")
+    return from_, to
+
+
+# Expresión SQL con el inicio del bucket en segundos desde epoch (UTC, sin zona horaria)
+def _bucket_expression(dialect: str, seconds: int):
+    if dialect == "mysql":
+        epoch = func.timestampdiff(literal_column("SECOND"), "1970-01-01", SensorReading.recorded_at)
+    elif dialect == "postgresql":
+        epoch = func.extract("epoch", SensorReading.recorded_at)
+    else:
+        return None
+    return func.floor(epoch / seconds) * seconds
+
+
+def _empty_series():
+    return {
+        "timestamps": [],
+        "count": [],
+        "temperature": {"min": [], "max": [], "mean": []},
+        "humidity": {"min": [], "max": [], "mean": []},
+    }
+
+
+def _append(series, ts, count, t_min, t_max, t_mean, h_min, h_max, h_mean):
+    series["timestamps"].append(int(ts))
+    series["count"].append(count)
+    series["temperature"]["min"].append(t_min)
+    series["temperature"]["max"].append(t_max)
+    series["temperature"]["mean"].append(t_mean)
+    series["humidity"]["min"].append(h_min)
+    series["humidity"]["max"].append(h_max)
+    series["humidity"]["mean"].append(h_mean)
+
+
+def _aggregate_sql(db: Session, bucket_expr, device_id, from_, to):
+    bucket_col = bucket_expr.label("bucket")
+    stmt = apply_sensor_filters(
+        select(
+            bucket_col,
+            func.count(SensorReading.id),
+            func.min(SensorReading.temperature), func.max(SensorReading.temperature), func.avg(SensorReading.temperature),
+            func.min(SensorReading.humidity), func.max(SensorReading.humidity), func.avg(SensorReading.humidity),
+        ),
+        device_id, from_, to,
+    ).group_by(bucket_col).order_by(bucket_col)
+    stmt = partition_scope(stmt, from_, to)
+
+    series = _empty_series()
+    for row in db.execute(stmt):
+        _append(series, row[0], row[1], *(float(v) if v is not None else None for v in row[2:]))
+    return series
+
+
+# Alternativa en Python (SQLite, o cuando parte del rango está archivado): acumula por
+# bucket contador, suma, mínimo y máximo, así la memoria depende del número de buckets y
+# no de filas. Las filas archivadas se consumen antes de abrir la consulta en streaming
+# de sensor_readings, que en MySQL no admite otra consulta mientras está abierta.
+def _aggregate_python(db: Session, seconds: int, device_id, from_, to, archived=None):
+    buckets = {}
+    if archived is not None:
+        _accumulate(buckets, seconds, ((row.recorded_at, row.temperature, row.humidity) for row in archived))
+    stmt = apply_sensor_filters(
+        select(SensorReading.recorded_at, SensorReading.temperature, SensorReading.humidity),
+        device_id, from_, to,
+    )
+    stmt = partition_scope(stmt, from_, to)
+    _accumulate(buckets, seconds, db.execute(stmt.execution_options(yield_per=5000)))
+
+    series = _empty_series()
+    for ts in sorted(buckets):
+        count, temperature, humidity = buckets[ts]
+        _append(series, ts, count, *_stat_values(temperature), *_stat_values(humidity))
+    return series
+
+
+# Cada bucket es [filas, stats de temperatura, stats de humedad]; stats = [n, suma, min, max]
+def _accumulate(buckets, seconds, rows):
+    for recorded_at, temperature, humidity in rows:
+        ts = int((recorded_at - EPOCH).total_seconds()) // seconds * seconds
+        bucket = buckets.get(ts)
+        if bucket is None:
+            bucket = buckets[ts] = [0, [0, 0.0, None, None], [0, 0.0, None, None]]
+        bucket[0] += 1
+        _add_value(bucket[1], temperature)
+        _add_value(bucket[2], humidity)
+
+
+def _add_value(stats, value):
+    if value is None:
+        return
+    if stats[0]:
+        stats[2] = min(stats[2], value)
+        stats[3] = max(stats[3], value)
+    else:
+        stats[2] = stats[3] = value
+    stats[0] += 1
+    stats[1] += value
+
+
+# (min, max, media) de unas stats, con None si no hubo valores
+def _stat_values(stats):
+    n, total, low, high = stats
+    return low, high, total / n if n else None
+
+
+def _floor_to(value: datetime, seconds: int) -> datetime:
+    return EPOCH + timedelta(seconds=int((value - EPOCH).total_seconds()) // seconds * seconds)
+
+
+# Tramo servido por rollups. Los cortes entre tramos caen a medianoche; solo from/to pueden
+# partir un bucket del rollup. Si quedan lecturas crudas, los trozos [from_, primer bucket
+# completo) y [último bucket completo, to) se calculan con ellas, como en el camino crudo.
+# En tramos sin crudas se devuelven los buckets enteros que tocan [from_, to): from_ se
+# redondea hacia abajo a la resolución del rollup.
+def _aggregate_rollup_tier(db: Session, resolution: str, seconds: int, device_id, from_, to, raw_edges: bool):
+    size = RESOLUTIONS[resolution]
+    if not raw_edges:
+        return _aggregate_rollups(db, resolution, seconds, device_id, _floor_to(from_, size), to)
+    first = _floor_to(from_, size)
+    if first < from_:
+        first += timedelta(seconds=size)
+    last = _floor_to(to, size)
+    if first >= last:
+        return _aggregate_raw(db, seconds, device_id, from_, to)
+    series = _empty_series()
+    if from_ < first:
+        _extend(series, _aggregate_raw(db, seconds, device_id, from_, first))
+    _extend(series, _aggregate_rollups(db, resolution, seconds, device_id, first, last))
+    if last < to:
+        _extend(series, _aggregate_raw(db, seconds, device_id, last, to))
+    return series
+
+
+# Lee el rollup más grueso que cubre el bucket y combina sus filas
+def _aggregate_rollups(db: Session, resolution: str, seconds: int, device_id, from_, to):
+    stmt = select(
+        SensorRollup.bucket_start, SensorRollup.count,
+        SensorRollup.temp_sum, SensorRollup.temp_min, SensorRollup.temp_max,
+        SensorRollup.hum_sum, SensorRollup.hum_min, SensorRollup.hum_max,
+    ).where(
+        SensorRollup.device_id == device_id,
+        SensorRollup.resolution == resolution,
+        SensorRollup.bucket_start >= from_,
+        SensorRollup.bucket_start < to,
+    ).order_by(SensorRollup.bucket_start)
+
+    series = _empty_series()
+    current = None
+    for bucket_start, count, t_sum, t_min, t_max, h_sum, h_min, h_max in db.execute(stmt):
+        ts = int((bucket_start - EPOCH).total_seconds()) // seconds * seconds
+        if current is None or current[0] != ts:
+            if current is not None:
+                _flush_rollup_bucket(series, current)
+            current = [ts, 0, 0.0, t_min, t_max, 0.0, h_min, h_max]
+        current[1] += count
+        current[2] += t_sum
+        current[3] = min(current[3], t_min)
+        current[4] = max(current[4], t_max)
+        current[5] += h_sum
+        current[6] = min(current[6], h_min)
+        current[7] = max(current[7], h_max)
+    if current is not None:
+        _flush_rollup_bucket(series, current)
+    return series
+
+
+def _flush_rollup_bucket(series, bucket):
+    ts, count, t_sum, t_min, t_max, h_sum, h_min, h_max = bucket
+    _append(series, ts, count, t_min, t_max, t_sum / count, h_min, h_max, h_sum / count)
+
+
+def _aggregate_raw(db: Session, seconds: int, device_id, from_, to):
+    # Las horas archivadas solo se pueden leer decodificando sus chunks
+    if has_chunks(db, device_id, from_, to):
+        return _aggregate_python(db, seconds, device_id, from_, to, iter_archived(db, device_id, from_, to))
+    bucket_expr = _bucket_expression(db.get_bind().dialect.name, seconds)
+    if bucket_expr is not None:
+        return _aggregate_sql(db, bucket_expr, device_id, from_, to)
+    return _aggregate_python(db, seconds, device_id, from_, to)
+
+
+# (count, t_min, t_max, t_mean, h_min, h_max, h_mean) del punto i
+def _point(series, i):
+    return (
+        series["count"][i],
+        *(series[measure][stat][i] for measure in ("temperature", "humidity") for stat in ("min", "max", "mean")),
+    )
+
+
+def _combine_stats(count_a, a, count_b, b):
+    a_min, a_max, a_mean = a
+    b_min, b_max, b_mean = b
+    if a_mean is None:
+        return b
+    if b_mean is None:
+        return a
+    return min(a_min, b_min), max(a_max, b_max), (a_mean * count_a + b_mean * count_b) / (count_a + count_b)
+
+
+# Concatena una serie a otra; si el primer punto cae en el mismo bucket que el último
+# (un trozo de bucket leído de crudas junto al resto leído del rollup) se combinan
+def _extend(series, part):
+    if part["timestamps"] and series["timestamps"] and part["timestamps"][0] == series["timestamps"][-1]:
+        count_a, *stats_a = _point(series, -1)
+        count_b, *stats_b = _point(part, 0)
+        ts = series["timestamps"][-1]
+        for values in (series["timestamps"], series["count"], *(
+            series[measure][stat] for measure in ("temperature", "humidity") for stat in ("min", "max", "mean")
+        )):
+            values.pop()
+        _append(
+            series, ts, count_a + count_b,
+            *_combine_stats(count_a, stats_a[:3], count_b, stats_b[:3]),
+            *_combine_stats(count_a, stats_a[3:], count_b, stats_b[3:]),
+        )
+        part = {
+            "timestamps": part["timestamps"][1:],
+            "count": part["count"][1:],
+            **{measure: {stat: part[measure][stat][1:] for stat in ("min", "max", "mean")} for measure in ("temperature", "humidity")},
+        }
+    series["timestamps"].extend(part["timestamps"])
+    series["count"].extend(part["count"])
+    for measure in ("temperature", "humidity"):
+        for stat in ("min", "max", "mean"):
+            series[measure][stat].extend(part[measure][stat])
+
+
+# El rango se parte en los cortes de retención y cada tramo se lee del nivel más fino
+# que aún existe; si es más grueso que el bucket pedido, esos puntos salen a su resolución
+def aggregate_readings(db: Session, device_id: int, bucket: str, from_: datetime = None, to: datetime = None):
+    from_, to = resolve_range(bucket, from_, to)
+    seconds = BUCKETS[bucket]
+    series = _empty_series()
+    tiers = []
+    for start, end, available in tier_segments(from_, to):
+        if "raw" in available and (ROLLUP_MODE == "off" or rollup_resolution_for(seconds) is None):
+            resolution = "raw"
+            part = _aggregate_raw(db, seconds, device_id, start, end)
+        else:
+            resolution = rollup_for_bucket(seconds, available)
+            part = _aggregate_rollup_tier(db, resolution, seconds, device_id, start, end, "raw" in available)
+        _extend(series, part)
+        if tiers and tiers[-1]["resolution"] == resolution:
+            tiers[-1]["to"] = end
+        else:
+            tiers.append({"from": start, "to": end, "resolution": resolution})
+    return {"device_id": device_id, "bucket": bucket, "from": from_, "to": to, "tiers": tiers, **series}
@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import logging
+import os
+from collections import namedtuple
+from itertools import groupby, islice
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, exists, func, select, tuple_
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Device, ReadingChunk, SensorReading
+from partitions import partition_scope, reading_tables
+from rollups import covered_by_rollups
+import gorilla
+
+logger = logging.getLogger(__name__)
+
+# Las horas cerradas hace más de ARCHIVE_AFTER_DAYS se guardan comprimidas en
+# sensor_chunks (una fila por dispositivo y hora) y salen de sensor_readings. 0 no archiva.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_MAX_HOURS = int(os.getenv("ARCHIVE_MAX_HOURS", "500"))
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "600"))
+# Chunks por consulta al leer el archivo
+ARCHIVE_READ_BATCH = int(os.getenv("ARCHIVE_READ_BATCH", "100"))
+
+HOUR = timedelta(hours=1)
+
+# Misma forma que las filas de sensor_readings que usan las rutas de lectura
+ArchivedReading = namedtuple("ArchivedReading", "id device_id temperature humidity recorded_at")
+
+
+def archive_cutoff(now: datetime = None):
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return ((now or datetime.utcnow()) - timedelta(days=ARCHIVE_AFTER_DAYS)).replace(minute=0, second=0, microsecond=0)
+
+
+def floor_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+# Los chunks guardan recorded_at en UTC sin zona, como sensor_readings
+def _utc_naive(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Horas (dispositivo, inicio) con lecturas crudas anteriores a before, en orden por
+# dispositivo. Cada paso es una búsqueda en el índice (device_id, recorded_at), así
+# que se puede borrar la hora devuelta antes de pedir la siguiente.
+def raw_hours(db: Session, before: datetime):
+    devices = db.scalars(partition_scope(
+        select(SensorReading.device_id).where(SensorReading.recorded_at < before).distinct(), None, before,
+    )).all()
+    for device_id in devices:
+        start = None
+        while True:
+            stmt = select(func.min(SensorReading.recorded_at)).where(
+                SensorReading.device_id == device_id, SensorReading.recorded_at < before,
+            )
+            if start is not None:
+                stmt = stmt.where(SensorReading.recorded_at >= start)
+            oldest = db.scalar(partition_scope(stmt, start, before))
+            if oldest is None:
+                break
+            hour = floor_hour(oldest)
+            yield device_id, hour
+            start = hour + HOUR
+
+
+def raw_hour_rows(db: Session, device_id: int, hour: datetime):
+    end = hour + HOUR
+    return db.execute(partition_scope(
+        select(SensorReading.id, SensorReading.recorded_at, SensorReading.temperature, SensorReading.humidity)
+        .where(SensorReading.device_id == device_id, SensorReading.recorded_at >= hour, SensorReading.recorded_at < end)
+        .order_by(SensorReading.recorded_at, SensorReading.id),
+        hour, end,
+    )).all()
+
+
+def delete_raw_hour(db: Session, device_id: int, hour: datetime):
+    end = hour + HOUR
+    for table in reading_tables(hour, end):
+        db.execute(delete(table).where(
+            table.c.device_id == device_id, table.c.recorded_at >= hour, table.c.recorded_at < end,
+        ))
+
+
+# Filas archivadas de una hora como (id, recorded_at, temperature, humidity)
+def chunk_rows(db: Session, device_id: int, hour: datetime):
+    data = db.scalar(select(ReadingChunk.data).where(
+        ReadingChunk.device_id == device_id, ReadingChunk.hour_start == hour,
+    ))
+    return gorilla.decode(data) if data is not None else []
+
+
+# Archiva una hora de un dispositivo en su propia transacción. Si ya había un chunk
+# (lecturas que llegaron tarde) se fusiona con él.
+def archive_hour(db: Session, device_id: int, hour: datetime) -> int:
+    rows = [tuple(row) for row in raw_hour_rows(db, device_id, hour)]
+    if not rows or not covered_by_rollups(db, max(row[0] for row in rows)):
+        return 0
+    # El formato no guarda nulos: esas horas se quedan en sensor_readings
+    if any(value is None for row in rows for value in row[2:]):
+        return 0
+    merged = sorted(rows + chunk_rows(db, device_id, hour), key=lambda row: (row[1], row[0]))
+    db.execute(delete(ReadingChunk).where(ReadingChunk.device_id == device_id, ReadingChunk.hour_start == hour))
+    db.add(ReadingChunk(device_id=device_id, hour_start=hour, count=len(merged), data=gorilla.encode(merged)))
+    delete_raw_hour(db, device_id, hour)
+    db.commit()
+    return len(rows)
+
+
+def archive_closed(db: Session, cutoff: datetime, max_hours: int = ARCHIVE_MAX_HOURS):
+    hours = rows = 0
+    for device_id, hour in raw_hours(db, cutoff):
+        if hours >= max_hours:
+            break
+        rows += archive_hour(db, device_id, hour)
+        hours += 1
+    return {"hours": hours, "rows": rows}
+
+
+def run_archive(now: datetime = None):
+    cutoff = archive_cutoff(now)
+    if cutoff is None:
+        return {}
+    db = SessionLocal()
+    try:
+        return archive_closed(db, cutoff)
+    finally:
+        db.close()
+
+
+async def periodic_archive(interval: float = ARCHIVE_INTERVAL):
+    while True:
+        try:
+            result = await asyncio.to_thread(run_archive)
+            if result.get("rows"):
+                logger.info("Archived %d readings in %d device-hours", result["rows"], result["hours"])
+        except Exception:
+            logger.exception("Archive run failed")
+        await asyncio.sleep(interval)
+
+
+def _chunk_query(device_id=None, from_=None, to=None, owner_id=None):
+    stmt = select(ReadingChunk.device_id, ReadingChunk.hour_start, ReadingChunk.data)
+    if device_id is not None:
+        stmt = stmt.where(ReadingChunk.device_id == device_id)
+    if owner_id is not None:
+        stmt = stmt.where(ReadingChunk.device_id.in_(select(Device.id).where(Device.user_id == owner_id)))
+    if from_ is not None:
+        stmt = stmt.where(ReadingChunk.hour_start >= floor_hour(from_))
+    if to is not None:
+        stmt = stmt.where(ReadingChunk.hour_start < to)
+    return stmt.order_by(ReadingChunk.hour_start, ReadingChunk.device_id)
+
+
+def has_chunks(db: Session, device_id=None, from_=None, to=None) -> bool:
+    stmt = _chunk_query(device_id, _utc_naive(from_), _utc_naive(to)).with_only_columns(ReadingChunk.device_id)
+    return db.scalar(select(exists(stmt.order_by(None)))) or False
+
+
+# Lecturas archivadas en orden (recorded_at, id). after es la clave (recorded_at, id)
+# del cursor: solo se devuelven filas posteriores. Las filas se decodifican hora a hora
+# según se piden.
+def iter_archived(db: Session, device_id=None, from_=None, to=None, owner_id=None, after=None):
+    from_, to = _utc_naive(from_), _utc_naive(to)
+    start = from_
+    if after is not None and (start is None or after[0] > start):
+        start = after[0]
+    chunks = _chunk_batches(db, _chunk_query(device_id, start, to, owner_id))
+    return _decode_chunks(chunks, from_, to, after)
+
+
+# Recorre los chunks por clave (hour_start, device_id) en lotes de ARCHIVE_READ_BATCH: cada
+# lote es una consulta corta que se lee entera, así la memoria queda acotada a un lote y la
+# consulta nunca queda abierta junto a un cursor en streaming de sensor_readings (MySQL)
+def _chunk_batches(db: Session, stmt, size: int = ARCHIVE_READ_BATCH):
+    last = None
+    while True:
+        batch = stmt
+        if last is not None:
+            batch = batch.where(tuple_(ReadingChunk.hour_start, ReadingChunk.device_id) > last)
+        chunks = db.execute(batch.limit(size)).all()
+        yield from chunks
+        if len(chunks) < size:
+            return
+        last = (chunks[-1].hour_start, chunks[-1].device_id)
+
+
+def _decode_chunks(chunks, from_, to, after):
+    for hour_start, group in groupby(chunks, key=lambda chunk: chunk.hour_start):
+        rows = []
+        for chunk_device, _, data in group:
+            for row_id, recorded_at, temperature, humidity in gorilla.decode(data):
+                if from_ is not None and recorded_at < from_ or to is not None and recorded_at >= to:
+                    continue
+                if after is not None and (recorded_at, row_id) <= after:
+                    continue
+                rows.append(ArchivedReading(row_id, chunk_device, temperature, humidity, recorded_at))
+        yield from sorted(rows, key=lambda row: (row.recorded_at, row.id))
+
+
+# Primeras limit + 1 lecturas archivadas. Se miran antes los contadores por hora (sin
+# leer los chunks) para decodificar solo las horas que hacen falta; la primera hora no
+# cuenta porque el rango o el cursor pueden dejar fuera parte de sus filas.
+def archived_page(db: Session, device_id=None, from_=None, to=None, owner_id=None, after=None, limit: int = 100):
+    hours = _chunk_query(device_id, _utc_naive(from_), _utc_naive(to), owner_id)
+    if after is not None:
+        hours = hours.where(ReadingChunk.hour_start >= floor_hour(after[0]))
+    hours = hours.with_only_columns(ReadingChunk.hour_start, func.sum(ReadingChunk.count)) \
+        .group_by(ReadingChunk.hour_start).order_by(ReadingChunk.hour_start)
+    last = None
+    total = 0
+    for index, (hour_start, count) in enumerate(db.execute(hours)):
+        last = hour_start
+        total += count if index else 0
+        if total > limit:
+            break
+    if last is None:
+        return []
+    end = last + HOUR
+    if to is not None:
+        end = min(end, _utc_naive(to))
+    return list(islice(iter_archived(db, device_id, from_, end, owner_id, after), limit + 1))
+
+
+# Une una página de sensor_readings con la del archivo (ambas ordenadas) y recorta a limit + 1
+def merge_pages(live, archived, limit: int):
+    if not archived:
+        return live
+    merged = heapq.merge(archived, live, key=lambda row: (row.recorded_at, row.id))
+    return [row for _, row in zip(range(limit + 1), merged)]
@@ -1,26 +1,56 @@
 from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from pydantic import BaseModel
+from typing import Optional
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import SessionLocal, AsyncSessionLocal
+from auth_cache import TokenCache, UserCache
+from models import User
 import os
 
 SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Token Bearer en el encabezado Authorization; /token es el endpoint de login para OAuth2
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# Igual pero sin 401 si falta: para rutas públicas que hacen algo más si quien llama es admin
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+# Cachés del camino de autenticación (ver /metrics/auth-cache)
+token_cache = TokenCache(maxsize=int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000")))
+user_cache = UserCache(
+    maxsize=int(os.getenv("AUTH_USER_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("AUTH_USER_CACHE_TTL", "30")),
+)
+
+# Usuario autenticado (sin el hash de la contraseña)
+class CurrentUser(BaseModel):
+    id: int
+    name: str = None
+    email: str = None
+    rol: str = None
+
 def create_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+# Verifica la firma solo la primera vez; después los claims salen de la caché hasta su exp
 def verify_token(token: str):
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    token_cache.put(token, payload)
+    return payload
 
 def get_db():
     db = SessionLocal()
@@ -28,3 +58,74 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# Variante asyncio de get_db para las rutas que no deben bloquear el event loop
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def load_user(user_id: int, db: AsyncSession):
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    db_user = await db.get(User, user_id)
+    if not db_user:
+        return None
+    user = CurrentUser(id=db_user.id, name=db_user.name, email=db_user.email, rol=db_user.rol)
+    user_cache.put(user_id, user)
+    return user
+
+# Token -> usuario; también para los WebSocket, que no pasan por oauth2_scheme
+async def user_from_token(token: str, db: AsyncSession) -> CurrentUser:
+    if not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    payload = verify_token(token)
+    user_id = payload.get("id")
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido o expirado")
+
+    user = await load_user(user_id, db)
+    if not user:
+        raise HTTPException(status_code=404, detail="Usuario no encontrado")
+    return user
+
+# Dependencia reutilizable: token Bearer -> usuario, resuelto una vez por petición desde la caché
+async def current_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> CurrentUser:
+    return await user_from_token(token, db)
+
+# Usuario autenticado o None si la petición no trae token
+async def optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> Optional[CurrentUser]:
+    if not token:
+        return None
+    return await user_from_token(token, db)
+
+# Restringe una ruta a ciertos roles: Depends(require_role("admin"))
+def require_role(*roles: str):
+    async def dependency(user: CurrentUser = Depends(current_user)) -> CurrentUser:
+        if user.rol not in roles:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+        return user
+    return dependency
+
+# Dueño por el que filtrar las consultas: None para admin (ve todo)
+def owner_scope(user: CurrentUser):
+    return None if user.rol == "admin" else user.id
+
+# Añade WHERE user_id = dueño a una consulta sobre un modelo con columna user_id
+def scope_to_owner(stmt, model, user: CurrentUser):
+    owner_id = owner_scope(user)
+    if owner_id is None:
+        return stmt
+    return stmt.where(model.user_id == owner_id)
+
+def can_access(obj, user: CurrentUser) -> bool:
+    return user.rol == "admin" or obj.user_id == user.id
+
+def auth_cache_stats():
+    return {"tokens": token_cache.stats(), "users": user_cache.stats()}
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# LRU de token -> claims ya verificados; cada entrada caduca con el exp del token
+class TokenCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            claims, expires_at = entry
+            if expires_at <= now:
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict):
+        expires_at = claims.get("exp")
+        if expires_at is None:
+            return
+        with self._lock:
+            self._entries[token] = (claims, float(expires_at))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return _stats(self.hits, self.misses, len(self._entries), self.maxsize)
+
+
+# Caché de usuarios por id con TTL corto (los cambios de rol tardan como mucho ttl segundos)
+class UserCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[1] <= now:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, user_id: int, user):
+        with self._lock:
+            self._entries[user_id] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        return {**_stats(self.hits, self.misses, len(self._entries), self.maxsize), "ttl": self.ttl}
+
+
+def _stats(hits: int, misses: int, size: int, maxsize: int):
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else None,
+        "size": size,
+        "maxsize": maxsize,
+    }
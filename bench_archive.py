@@ -0,0 +1,126 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, select
+from models import Base, Device, ReadingChunk, SensorReading
+import gorilla
+
+# Benchmark: almacenamiento por lectura y tiempo de leer un rango, con las lecturas en
+# sensor_readings frente a archivadas en sensor_chunks (SQLite, base en un fichero temporal).
+#   python bench_archive.py --devices 20 --hours 48 --interval 10 --decimals 2
+# Con --decimals 0 los valores son dobles aleatorios sin redondear (el peor caso para XOR).
+
+
+def make_series(devices: int, hours: int, interval: int, decimals: int):
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1)
+    per_hour = 3600 // interval
+    row_id = 0
+    series = {}
+    for device_id in range(1, devices + 1):
+        temperature, humidity = rnd.uniform(18, 24), rnd.uniform(40, 60)
+        rows = []
+        for step in range(hours * per_hour):
+            # Paseo aleatorio lento, como un sensor real, redondeado a su precisión
+            temperature += rnd.gauss(0, 0.02)
+            humidity += rnd.gauss(0, 0.05)
+            t, h = (round(temperature, decimals), round(humidity, decimals)) if decimals else (temperature, humidity)
+            row_id += 1
+            rows.append((row_id, start + timedelta(seconds=step * interval), t, h))
+        series[device_id] = rows
+    return series
+
+
+def file_size(engine) -> int:
+    with engine.connect() as conn:
+        conn.exec_driver_sql("VACUUM")
+    return os.path.getsize(engine.url.database)
+
+
+def load_raw(engine, series):
+    with engine.begin() as conn:
+        conn.execute(insert(SensorReading), [
+            {"id": row_id, "device_id": device_id, "recorded_at": ts, "temperature": t, "humidity": h}
+            for device_id, rows in series.items() for row_id, ts, t, h in rows
+        ])
+
+
+def load_chunks(engine, series):
+    values = []
+    for device_id, rows in series.items():
+        hours = {}
+        for row in rows:
+            hours.setdefault(row[1].replace(minute=0, second=0, microsecond=0), []).append(row)
+        for hour, hour_rows in hours.items():
+            values.append({"device_id": device_id, "hour_start": hour, "count": len(hour_rows), "data": gorilla.encode(hour_rows)})
+    with engine.begin() as conn:
+        conn.execute(insert(ReadingChunk), values)
+    return sum(len(value["data"]) for value in values)
+
+
+def scan_raw(engine, device_id, from_, to):
+    with engine.connect() as conn:
+        return len(conn.execute(select(SensorReading.id, SensorReading.recorded_at, SensorReading.temperature, SensorReading.humidity).where(
+            SensorReading.device_id == device_id, SensorReading.recorded_at >= from_, SensorReading.recorded_at < to,
+        ).order_by(SensorReading.recorded_at)).all())
+
+
+def scan_chunks(engine, device_id, from_, to):
+    with engine.connect() as conn:
+        chunks = conn.execute(select(ReadingChunk.data).where(
+            ReadingChunk.device_id == device_id, ReadingChunk.hour_start >= from_, ReadingChunk.hour_start < to,
+        ).order_by(ReadingChunk.hour_start)).scalars().all()
+    return sum(len(gorilla.decode(data)) for data in chunks)
+
+
+def time_it(fn, repeat: int, *args):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = fn(*args)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return timings[len(timings) // 2], count
+
+
+def run(devices: int, hours: int, interval: int, decimals: int, scan_hours: int, repeat: int):
+    series = make_series(devices, hours, interval, decimals)
+    total = sum(len(rows) for rows in series.values())
+    print(f"devices={devices} hours={hours} interval={interval}s decimals={decimals or 'full'} rows={total:,}")
+    with tempfile.TemporaryDirectory() as tmp:
+        engines = {}
+        for name in ("raw", "chunks"):
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, name + '.db')}")
+            Base.metadata.create_all(engine, tables=[Device.__table__, SensorReading.__table__, ReadingChunk.__table__])
+            engines[name] = engine
+        load_raw(engines["raw"], series)
+        payload = load_chunks(engines["chunks"], series)
+        raw_size = file_size(engines["raw"])
+        chunk_size = file_size(engines["chunks"])
+        print(f"  sensor_readings  {raw_size:>12,} B  {raw_size / total:6.2f} B/row (tabla + índices)")
+        print(f"  sensor_chunks    {chunk_size:>12,} B  {chunk_size / total:6.2f} B/row  ratio {raw_size / chunk_size:5.1f}x")
+        print(f"  chunk payload    {payload:>12,} B  {payload / total:6.2f} B/row  (16 B/row en crudo: ts + 2 dobles)")
+
+        from_ = datetime(2024, 1, 1) + timedelta(hours=hours // 2)
+        to = from_ + timedelta(hours=scan_hours)
+        for name, fn in (("raw", scan_raw), ("chunks", scan_chunks)):
+            elapsed, count = time_it(fn, repeat, engines[name], 1, from_, to)
+            print(f"  scan {scan_hours}h {name:7s} {count:>8,} rows  {elapsed * 1000:8.2f} ms  {count / max(elapsed, 1e-9) / 1e6:6.2f} M rows/s")
+        for engine in engines.values():
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--hours", type=int, default=48)
+    parser.add_argument("--interval", type=int, default=10, help="seconds between readings")
+    parser.add_argument("--decimals", type=int, action="append", help="sensor precision (repeatable, 0 = full doubles)")
+    parser.add_argument("--scan-hours", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for decimals in args.decimals or [1, 2, 0]:
+        run(args.devices, args.hours, args.interval, decimals, args.scan_hours, args.repeat)
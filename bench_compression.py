@@ -0,0 +1,67 @@
+import argparse
+import time
+import zlib
+from bench_serialization import make_rows
+from fast_json import dumps, rows_to_dicts
+from sensor_formats import PAGE_FIELDS, columnar_json, packed
+from compression import available_encoders
+
+# Benchmark: CPU de comprimir páginas típicas de /sensores frente a bytes ahorrados,
+# por formato (JSON por filas, columnar, empaquetado) y codificación.
+#   python bench_compression.py --rows 100 --rows 1000 --rows 10000
+
+LEVELS = {
+    "gzip": (1, 6, 9),
+    "br": (1, 4, 6),
+    "zstd": (1, 3, 9),
+}
+
+
+def payloads(rows: int):
+    data = make_rows(rows)
+    return {
+        "json": dumps({"items": rows_to_dicts(PAGE_FIELDS, data), "next_cursor": None}),
+        "columnar": columnar_json(data),
+        "packed": packed(data),
+    }
+
+
+def compressor(encoding: str, level: int):
+    if encoding == "gzip":
+        return lambda data: zlib.compress(data, level, wbits=31)
+    if encoding == "br":
+        import brotli
+        return lambda data: brotli.compress(data, quality=level)
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress
+
+
+def time_it(fn, data: bytes, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(data)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return timings[len(timings) // 2], len(out)
+
+
+def run(rows: int, repeat: int):
+    print(f"rows={rows:,}")
+    for name, data in payloads(rows).items():
+        print(f"  {name:9s} {len(data):>10,} B")
+        for encoding in available_encoders():
+            for level in LEVELS[encoding]:
+                elapsed, size = time_it(compressor(encoding, level), data, repeat)
+                saved = len(data) - size
+                print(f"    {encoding:4s} l{level:<2d} {size:>10,} B  ratio {len(data) / size:5.1f}x"
+                      f"  {elapsed * 1000:8.2f} ms  {saved / 1024 / max(elapsed * 1000, 1e-6):8.1f} KiB saved/ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, action="append", help="rows per page (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for rows in args.rows or [100, 1000, 10_000]:
+        run(rows, args.repeat)
@@ -0,0 +1,91 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, select, text
+from models import SensorReading
+from sensor_queries import apply_sensor_filters
+
+# Benchmark: latencia de "lecturas del dispositivo X en las últimas N horas"
+# con y sin el índice (device_id, recorded_at), sobre SQLite en un archivo temporal.
+#   python bench_sensor_index.py --rows 1000000 --rows 10000000
+
+INDEX_NAME = "ix_sensor_readings_device_recorded"
+DEVICES = 200
+CHUNK = 50000
+
+
+def populate(engine, rows: int):
+    table = SensorReading.__table__
+    start = datetime(2024, 1, 1)
+    # Una lectura por dispositivo cada ~N segundos, intercaladas como en producción
+    step = timedelta(seconds=max(1, (90 * 24 * 3600 * DEVICES) // rows))
+    rnd = random.Random(42)
+    with engine.begin() as conn:
+        for offset in range(0, rows, CHUNK):
+            conn.execute(insert(table), [
+                {
+                    "device_id": (i % DEVICES) + 1,
+                    "temperature": rnd.uniform(15, 30),
+                    "humidity": rnd.uniform(30, 70),
+                    "recorded_at": start + step * (i // DEVICES),
+                }
+                for i in range(offset, min(offset + CHUNK, rows))
+            ])
+    return start + step * (rows // DEVICES)
+
+
+def time_query(engine, end: datetime, hours: int, repeat: int):
+    stmt = apply_sensor_filters(
+        select(SensorReading.id, SensorReading.temperature, SensorReading.humidity, SensorReading.recorded_at),
+        device_id=DEVICES // 2, from_=end - timedelta(hours=hours), to=end,
+    )
+    timings = []
+    with engine.connect() as conn:
+        plan = conn.execute(text("EXPLAIN QUERY PLAN " + str(stmt.compile(compile_kwargs={"literal_binds": True})))).all()
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            count = len(conn.execute(stmt).all())
+            timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return timings[len(timings) // 2], count, " | ".join(row[-1] for row in plan)
+
+
+def run(rows: int, hours: int, repeat: int):
+    fd, path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    try:
+        engine = create_engine(f"sqlite:///{path}")
+        table = SensorReading.__table__
+        # Tabla sin el índice compuesto para medir el "antes"
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE sensor_readings (id INTEGER PRIMARY KEY, device_id INTEGER, "
+                "temperature FLOAT, humidity FLOAT, recorded_at DATETIME)"
+            ))
+        end = populate(engine, rows)
+
+        before, count, plan_before = time_query(engine, end, hours, repeat)
+        next(index for index in table.indexes if index.name == INDEX_NAME).create(engine)
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        after, _, plan_after = time_query(engine, end, hours, repeat)
+
+        print(f"rows={rows:,} matched={count} window={hours}h")
+        print(f"  without index: {before * 1000:9.2f} ms  [{plan_before}]")
+        print(f"  with index:    {after * 1000:9.2f} ms  [{plan_after}]")
+        engine.dispose()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, action="append", help="rows to load (repeatable)")
+    parser.add_argument("--hours", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for rows in args.rows or [1_000_000, 10_000_000]:
+        run(rows, args.hours, args.repeat)
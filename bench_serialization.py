@@ -0,0 +1,73 @@
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+from models import SensorDataOut, SensorPage
+from fast_json import dumps, rows_to_dicts
+
+# Benchmark: coste por fila de serializar una página de /sensores.
+#   pydantic: un SensorDataOut por fila + validación de response_model + json.dumps (antes)
+#   dump_json: TypeAdapter valida los dicts y serializa a bytes en pydantic-core
+#   orjson: tuplas -> dicts -> bytes (ruta actual)
+#   python bench_serialization.py --rows 10000 --rows 100000
+
+FIELDS = ("id", "device_id", "temperature", "humidity", "recorded_at")
+page_adapter = TypeAdapter(SensorPage)
+
+
+def make_rows(rows: int):
+    rnd = random.Random(42)
+    start = datetime(2024, 1, 1)
+    return [
+        (i + 1, (i % 200) + 1, rnd.uniform(15, 30), rnd.uniform(30, 70), start + timedelta(seconds=i))
+        for i in range(rows)
+    ]
+
+
+# Lo que hacía FastAPI con response_model: modelo por fila, validar y volver a serializar
+def serialize_pydantic(rows):
+    page = SensorPage(items=[
+        SensorDataOut(id=r[0], device_id=r[1], temperature=r[2], humidity=r[3], recorded_at=r[4])
+        for r in rows
+    ])
+    validated = page_adapter.validate_python(page.model_dump())
+    return json.dumps(page_adapter.dump_python(validated, mode="json")).encode("utf-8")
+
+
+def serialize_dump_json(rows):
+    page = page_adapter.validate_python({"items": rows_to_dicts(FIELDS, rows), "next_cursor": None})
+    return page_adapter.dump_json(page)
+
+
+def serialize_orjson(rows):
+    return dumps({"items": rows_to_dicts(FIELDS, rows), "next_cursor": None})
+
+
+def time_it(fn, rows, repeat: int):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(rows)
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def run(rows: int, repeat: int):
+    data = make_rows(rows)
+    assert json.loads(serialize_orjson(data)) == json.loads(serialize_pydantic(data))
+    print(f"rows={rows:,}")
+    for name, fn in (("pydantic", serialize_pydantic), ("dump_json", serialize_dump_json), ("orjson", serialize_orjson)):
+        elapsed = time_it(fn, data, repeat)
+        print(f"  {name:10s} {elapsed * 1000:9.2f} ms  {elapsed / rows * 1e6:7.3f} us/row")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, action="append", help="rows per page (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for rows in args.rows or [10_000, 100_000]:
+        run(rows, args.repeat)
@@ -0,0 +1,239 @@
+import os
+import zlib
+
+# brotli y zstandard son opcionales: sin ellos solo se ofrece gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Orden de preferencia del servidor cuando el cliente acepta varias con la misma q
+COMPRESSION_ENCODINGS = os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",")
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# Ya comprimidos, binarios compactos o eventos que no deben quedarse en un buffer
+EXCLUDED_MEDIA_TYPES = (
+    "image/", "video/", "audio/",
+    "application/zip", "application/gzip", "application/octet-stream",
+    "application/vnd.sensor.packed", "application/vnd.apache.arrow.stream",
+    "text/event-stream",
+)
+
+
+class _GzipEncoder:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encoders():
+    encoders = {"gzip": _GzipEncoder}
+    if brotli is not None:
+        encoders["br"] = _BrotliEncoder
+    if zstandard is not None:
+        encoders["zstd"] = _ZstdEncoder
+    return encoders
+
+
+# Codificación de mayor q aceptada por el cliente; a igual q gana el orden del servidor
+def negotiate_encoding(accept_encoding: str, encoders):
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        key, _, value = params.strip().partition("=")
+        if key == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    best = None
+    for rank, name in enumerate(COMPRESSION_ENCODINGS):
+        quality = accepted.get(name, accepted.get("*", 0.0))
+        if name in encoders and quality > 0 and (best is None or quality > best[0]):
+            best = (quality, rank, name)
+    return best[2] if best else None
+
+
+# Middleware ASGI de compresión. routes asigna a un prefijo de ruta su umbral en bytes
+# (None la excluye); el resto usa minimum_size. Las respuestas en streaming se
+# acumulan hasta el umbral y, si lo superan, se comprimen trozo a trozo.
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, routes: dict = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        # Los prefijos más largos primero para que el más específico gane
+        self.routes = sorted((routes or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.encoders = available_encoders()
+
+    def threshold_for(self, path: str):
+        for prefix, threshold in self.routes:
+            if path.startswith(prefix):
+                return threshold
+        return self.minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        threshold = self.threshold_for(scope["path"])
+        headers = dict((k.lower(), v) for k, v in scope["headers"])
+        encoding = negotiate_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"), self.encoders)
+        if threshold is None:
+            await self.app(scope, receive, send)
+            return
+        if encoding is None:
+            # Sin compresión para este cliente, pero la respuesta sigue dependiendo de Accept-Encoding
+            async def send_with_vary(message):
+                if message["type"] == "http.response.start" and _varies(message):
+                    message = _with_vary(message)
+                await send(message)
+            await self.app(scope, receive, send_with_vary)
+            return
+        responder = _CompressedResponder(send, encoding, self.encoders[encoding], threshold)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressedResponder:
+    def __init__(self, send, encoding: str, encoder_class, threshold: int):
+        self._send = send
+        self.encoding = encoding
+        self.encoder_class = encoder_class
+        self.threshold = threshold
+        self.start = None
+        self.buffer = []
+        self.buffered = 0
+        self.encoder = None
+        self.passthrough = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            self.passthrough = not _compressible(message)
+            if self.passthrough:
+                await self._send(_with_vary(message) if _varies(message) else message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            chunk = self.encoder.compress(body)
+            if not more_body:
+                chunk += self.encoder.finish()
+            if chunk or not more_body:
+                await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if more_body and self.buffered < self.threshold:
+            return
+
+        data = b"".join(self.buffer)
+        self.buffer = []
+        if self.buffered < self.threshold:
+            # Respuesta completa por debajo del umbral: sale sin comprimir, con Vary igualmente
+            # para que la caché de ETag o un proxy no la sirvan a quien pidió otra codificación
+            await self._send(_with_vary(self.start))
+            await self._send({"type": "http.response.body", "body": data, "more_body": False})
+            return
+
+        self.encoder = self.encoder_class()
+        chunk = self.encoder.compress(data)
+        if not more_body:
+            chunk += self.encoder.finish()
+        await self._send(_compressed_start(self.start, self.encoding, None if more_body else len(chunk)))
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+
+def _compressible(start) -> bool:
+    if start["status"] < 200 or start["status"] in (204, 304):
+        return False
+    headers = dict((k.lower(), v) for k, v in start.get("headers", []))
+    if b"content-encoding" in headers:
+        return False
+    content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+    return not content_type.startswith(EXCLUDED_MEDIA_TYPES)
+
+
+# Respuestas cuya representación depende de Accept-Encoding: las comprimibles y los 304,
+# que deben llevar el mismo Vary que la respuesta completa
+def _varies(start) -> bool:
+    return start["status"] == 304 or _compressible(start)
+
+
+def _vary_value(vary):
+    if not vary:
+        return b"Accept-Encoding"
+    if b"accept-encoding" in [part.strip().lower() for part in vary.split(b",")]:
+        return vary
+    return vary + b", Accept-Encoding"
+
+
+def _with_vary(start):
+    headers = [(key, value) for key, value in start.get("headers", []) if key.lower() != b"vary"]
+    vary = b", ".join(value for key, value in start.get("headers", []) if key.lower() == b"vary")
+    headers.append((b"vary", _vary_value(vary)))
+    return {**start, "headers": headers}
+
+
+def _compressed_start(start, encoding: str, length):
+    headers = []
+    vary = None
+    for key, value in start.get("headers", []):
+        name = key.lower()
+        if name == b"content-length":
+            continue
+        if name == b"vary":
+            vary = value
+            continue
+        # El cuerpo ya no es idéntico byte a byte: el ETag pasa a ser débil
+        if name == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        headers.append((key, value))
+    headers.append((b"content-encoding", encoding.encode("latin-1")))
+    headers.append((b"vary", _vary_value(vary)))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode("latin-1")))
+    return {**start, "headers": headers}
@@ -1,13 +1,68 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
+from pool_metrics import pool_metrics, async_pool_metrics, instrumented_pool_class, instrument_engine
 import os
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL)
+# Configuración del pool de conexiones (ver /metrics/db-pool para dimensionarlo)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# pre_ping y recycle evitan usar conexiones que MySQL cerró por inactividad (wait_timeout)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Drivers asyncio equivalentes a los síncronos
+ASYNC_DRIVERS = {
+    "mysql+pymysql": "mysql+aiomysql",
+    "mysql+mysqldb": "mysql+aiomysql",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url: str) -> str:
+    explicit = os.getenv("ASYNC_DATABASE_URL")
+    if explicit:
+        return explicit
+    scheme, _, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+
+def pool_options(url: str, pool_class):
+    # SQLite (tests) usa su propio pool por defecto
+    if url.startswith("sqlite"):
+        return {"pool_pre_ping": DB_POOL_PRE_PING}
+    return {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+engine = instrument_engine(
+    create_engine(DATABASE_URL, **pool_options(DATABASE_URL, instrumented_pool_class(QueuePool, pool_metrics))),
+    pool_metrics,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+
+# Engine asyncio (aiomysql / aiosqlite) para las rutas más cargadas
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **pool_options(ASYNC_DATABASE_URL, instrumented_pool_class(AsyncAdaptedQueuePool, async_pool_metrics)),
+)
+instrument_engine(async_engine.sync_engine, async_pool_metrics)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+Base = declarative_base()
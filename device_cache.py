@@ -0,0 +1,54 @@
+import os
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Device
+
+KNOWN_DEVICES_TTL = float(os.getenv("KNOWN_DEVICES_TTL", "300"))
+
+
+# Ids de dispositivos que existen, para que el camino write-behind compruebe el dispositivo
+# antes de responder 202 sin ir a la base de datos en cada lectura. Solo se guardan los
+# positivos, con TTL: un id desconocido se consulta siempre (un dispositivo recién creado en
+# otro proceso se acepta enseguida) y un borrado en otro proceso tarda como mucho ttl segundos.
+class KnownDevices:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._expires = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, device_id: int) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._expires.get(device_id)
+            if expires_at is None or expires_at <= now:
+                self._expires.pop(device_id, None)
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, device_id: int):
+        with self._lock:
+            self._expires[device_id] = time.monotonic() + self.ttl
+
+    def discard(self, device_id: int):
+        with self._lock:
+            self._expires.pop(device_id, None)
+
+    async def exists(self, device_id: int, db: AsyncSession) -> bool:
+        if device_id in self:
+            return True
+        if await db.scalar(select(Device.id).where(Device.id == device_id)) is None:
+            return False
+        self.add(device_id)
+        return True
+
+    def stats(self):
+        return {"size": len(self._expires), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+known_devices = KnownDevices(KNOWN_DEVICES_TTL)
@@ -1,9 +1,25 @@
-from fastapi import UploadFile, HTTPException
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
 from openpyxl import load_workbook
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from models import User
+from jobs import JobProcessor, register_processor
+from response_cache import response_cache
 import bcrypt  
 
+# Filas por lote: se hashean en paralelo y se insertan con un INSERT multi-row
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "200"))
+IMPORT_HASH_WORKERS = int(os.getenv("IMPORT_HASH_WORKERS", str(os.cpu_count() or 2)))
+VALID_ROLES = ("admin", "normal")
+
+_executor = None
+_executor_lock = threading.Lock()
+
 
 # Función para hashear la contraseña
 def hash_password(password: str) -> str:
@@ -12,19 +28,126 @@ def hash_password(password: str) -> str:
     return hashed.decode("utf-8")
 
 
-# Función para importar Excel
-async def import_excel(file: UploadFile, db: Session):
-    workbook = load_workbook(file.file)
-    sheet = workbook.active
-    rows = list(sheet.iter_rows(values_only=True))[1:]
-
-    for row in rows:
-        name, email, password, rol = row
-        hashed_password = hash_password(password)
-        
-        # Crear usuario
-        user = User(name=name, email=email, password=hashed_password, rol=rol)
-        db.add(user)
-    
-    db.commit()
-    return {"message": "Excel data imported successfully"}
+# Pool de procesos propio para no competir con los logins (password_pool). Lo piden
+# varios hilos de JOB_WORKERS a la vez: se crea bajo el lock para no abrir dos pools.
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+# Un worker muerto rompe el pool: se descarta (si nadie lo ha sustituido ya) y se crea otro
+def _discard_executor(broken):
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def _hash_all(passwords):
+    executor = _get_executor()
+    try:
+        return list(executor.map(hash_password, passwords))
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        return list(_get_executor().map(hash_password, passwords))
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+# Recorre la hoja en modo solo lectura (sin cargar el libro entero en memoria).
+# min_row=2 salta la cabecera; también lo usa la importación de lecturas de sensores.
+def iter_sheet_rows(path: str, min_row: int = 2):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        for number, row in enumerate(sheet.iter_rows(min_row=min_row, values_only=True), start=min_row):
+            if not row or all(value is None for value in row):
+                continue
+            yield number, row
+    finally:
+        workbook.close()
+
+
+def _validate_row(row):
+    if len(row) < 4:
+        return None, "Expected columns: name, email, password, rol"
+    name, email, password, rol = row[:4]
+    if not email or not password:
+        return None, "Missing email or password"
+    rol = rol or "normal"
+    if rol not in VALID_ROLES:
+        return None, "Invalid rol. Must be 'admin' or 'normal'."
+    return {"name": name, "email": str(email).strip(), "password": str(password), "rol": rol}, None
+
+
+# Procesa un lote para el JobRunner: valida, hashea en paralelo e inserta sin hacer commit
+def process_user_chunk(db: Session, chunk, options=None):
+    errors = []
+    users = []
+    emails = set()
+    for number, row in chunk:
+        user, error = _validate_row(row)
+        if error:
+            errors.append((number, error))
+        elif user["email"] in emails:
+            errors.append((number, f"Duplicate email in file: {user['email']}"))
+        else:
+            emails.add(user["email"])
+            users.append((number, user))
+
+    # Un solo SELECT por lote para detectar emails ya registrados
+    existing = set()
+    if emails:
+        existing = set(db.scalars(select(User.email).where(User.email.in_(emails))))
+    pending = []
+    for number, user in users:
+        if user["email"] in existing:
+            errors.append((number, f"Email already registered: {user['email']}"))
+        else:
+            pending.append((number, user))
+    if not pending:
+        return 0, errors, None
+
+    hashes = _hash_all([user["password"] for _, user in pending])
+    for (_, user), hashed in zip(pending, hashes):
+        user["password"] = hashed
+    try:
+        with db.begin_nested():
+            db.execute(insert(User), [user for _, user in pending])
+        return len(pending), errors, None
+    except IntegrityError:
+        # Otro proceso registró alguno de los emails: se reintenta fila a fila
+        done = 0
+        for number, user in pending:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(User), [user])
+                done += 1
+            except IntegrityError:
+                errors.append((number, f"Email already registered: {user['email']}"))
+        return done, errors, None
+
+
+def iter_user_file(path: str, options=None):
+    return iter_sheet_rows(path)
+
+
+# Cada lote confirmado cambia /users: se invalida su caché de respuestas
+def users_committed(committed):
+    response_cache.invalidate("users")
+
+
+register_processor("users", JobProcessor(
+    iter_user_file, process_user_chunk,
+    chunk_size=IMPORT_CHUNK_SIZE, after_commit=users_committed,
+))
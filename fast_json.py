@@ -0,0 +1,30 @@
+from decimal import Decimal
+import orjson
+from fastapi.responses import Response
+
+# orjson serializa dict, list, datetime y float directamente a bytes. Las respuestas
+# que devuelven un Response no pasan por response_model ni por jsonable_encoder.
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+# AVG/SUM en MySQL devuelven Decimal
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=JSON_OPTIONS)
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+# Filas de columnas (tuplas) -> lista de dicts sin construir modelos Pydantic
+def rows_to_dicts(fields, rows):
+    return [dict(zip(fields, row)) for row in rows]
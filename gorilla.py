@@ -0,0 +1,164 @@
+import struct
+from datetime import datetime, timedelta
+
+# Codificación sin pérdida de una serie de lecturas (estilo Gorilla de Facebook):
+#   ids y timestamps (microsegundos): delta de deltas con prefijos de longitud variable
+#   temperature y humidity: XOR con el valor anterior, guardando solo los bits significativos
+# Las columnas se escriben una tras otra en un único flujo de bits:
+#   versión (8) | n (32) | ids | timestamps | temperature | humidity
+
+VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+# (prefijo, bits del valor con signo) para delta de deltas distinto de 0
+DOD_BUCKETS = (("10", 7), ("110", 9), ("1110", 12), ("11110", 32), ("11111", 64))
+
+
+class BitWriter:
+    def __init__(self):
+        self._parts = []
+
+    def write(self, value: int, bits: int):
+        self._parts.append(format(value & ((1 << bits) - 1), f"0{bits}b"))
+
+    def flag(self, prefix: str):
+        self._parts.append(prefix)
+
+    def to_bytes(self) -> bytes:
+        bits = "".join(self._parts)
+        bits += "0" * (-len(bits) % 8)
+        return int(bits, 2).to_bytes(len(bits) // 8, "big") if bits else b""
+
+
+class BitReader:
+    def __init__(self, data: bytes):
+        self._bits = format(int.from_bytes(data, "big"), f"0{len(data) * 8}b") if data else ""
+        self._pos = 0
+
+    def read(self, bits: int) -> int:
+        value = int(self._bits[self._pos:self._pos + bits], 2)
+        self._pos += bits
+        return value
+
+    def read_signed(self, bits: int) -> int:
+        value = self.read(bits)
+        return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+    def bit(self) -> str:
+        value = self._bits[self._pos]
+        self._pos += 1
+        return value
+
+
+def _write_dod(writer: BitWriter, values):
+    writer.write(values[0], 64)
+    previous, delta = values[0], 0
+    for value in values[1:]:
+        new_delta = value - previous
+        dod = new_delta - delta
+        if dod == 0:
+            writer.flag("0")
+        else:
+            for prefix, bits in DOD_BUCKETS:
+                if -(1 << (bits - 1)) <= dod < (1 << (bits - 1)):
+                    writer.flag(prefix)
+                    writer.write(dod, bits)
+                    break
+        previous, delta = value, new_delta
+
+
+def _read_dod(reader: BitReader, count: int):
+    value = reader.read_signed(64)
+    values = [value]
+    delta = 0
+    for _ in range(count - 1):
+        if reader.bit() == "0":
+            dod = 0
+        else:
+            bits = None
+            for _, size in DOD_BUCKETS[:-1]:
+                if reader.bit() == "0":
+                    bits = size
+                    break
+            dod = reader.read_signed(bits or DOD_BUCKETS[-1][1])
+        delta += dod
+        value += delta
+        values.append(value)
+    return values
+
+
+def _float_bits(values):
+    return struct.unpack(f"<{len(values)}Q", struct.pack(f"<{len(values)}d", *values))
+
+
+def _write_xor(writer: BitWriter, values):
+    bits = _float_bits(values)
+    writer.write(bits[0], 64)
+    previous = bits[0]
+    leading = trailing = -1
+    for current in bits[1:]:
+        xor = current ^ previous
+        previous = current
+        if xor == 0:
+            writer.flag("0")
+            continue
+        new_leading = min(64 - xor.bit_length(), 31)
+        new_trailing = (xor & -xor).bit_length() - 1
+        # Si los bits significativos caben en la ventana anterior se reutiliza
+        if leading >= 0 and new_leading >= leading and new_trailing >= trailing:
+            writer.flag("10")
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = new_leading, new_trailing
+            meaningful = 64 - leading - trailing
+            writer.flag("11")
+            writer.write(leading, 5)
+            writer.write(meaningful - 1, 6)
+            writer.write(xor >> trailing, meaningful)
+
+
+def _read_xor(reader: BitReader, count: int):
+    previous = reader.read(64)
+    bits = [previous]
+    leading = trailing = 0
+    for _ in range(count - 1):
+        if reader.bit() == "1":
+            if reader.bit() == "1":
+                leading = reader.read(5)
+                trailing = 64 - leading - (reader.read(6) + 1)
+            previous ^= reader.read(64 - leading - trailing) << trailing
+        bits.append(previous)
+    return struct.unpack(f"<{count}d", struct.pack(f"<{count}Q", *bits))
+
+
+# rows: (id, recorded_at, temperature, humidity) ordenadas por (recorded_at, id), sin nulos
+def encode(rows) -> bytes:
+    writer = BitWriter()
+    writer.write(VERSION, 8)
+    writer.write(len(rows), 32)
+    if rows:
+        ids, recorded_at, temperatures, humidities = zip(*rows)
+        _write_dod(writer, ids)
+        _write_dod(writer, [(ts - EPOCH) // MICROSECOND for ts in recorded_at])
+        _write_xor(writer, temperatures)
+        _write_xor(writer, humidities)
+    return writer.to_bytes()
+
+
+def decode(data: bytes):
+    reader = BitReader(data)
+    version = reader.read(8)
+    if version != VERSION:
+        raise ValueError(f"Unsupported chunk version: {version}")
+    count = reader.read(32)
+    if not count:
+        return []
+    ids = _read_dod(reader, count)
+    timestamps = _read_dod(reader, count)
+    temperatures = _read_xor(reader, count)
+    humidities = _read_xor(reader, count)
+    return [
+        (row_id, EPOCH + ts * MICROSECOND, temperature, humidity)
+        for row_id, ts, temperature, humidity in zip(ids, timestamps, temperatures, humidities)
+    ]
@@ -0,0 +1,283 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import IdempotencyRecord, ReadingChunk, SensorReading
+from partitions import partition_scope, partitions, retention_cutoff
+from retention import tier_cutoff
+from archive import archive_cutoff, floor_hour
+import gorilla
+
+logger = logging.getLogger(__name__)
+
+# Claves recientes que se recuerdan en memoria (por proceso) para cortar reintentos sin
+# ir a la base de datos. Es un LRU y no un filtro de Bloom: un falso positivo de Bloom
+# descartaría una lectura legítima.
+RECENT_READING_KEYS = int(os.getenv("INGEST_RECENT_READING_KEYS", "100000"))
+RECENT_IDEMPOTENCY_KEYS = int(os.getenv("INGEST_RECENT_IDEMPOTENCY_KEYS", "10000"))
+# Cuánto se guarda una Idempotency-Key en la tabla idempotency_keys
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", "86400"))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", "3600"))
+MAX_KEY_LENGTH = 200
+# Claves por SELECT al buscar lecturas ya guardadas
+LOOKUP_CHUNK_SIZE = 500
+
+REPLAY_HEADER = "Idempotent-Replayed"
+EXPIRED_ERROR = "recorded_at is older than the raw retention window"
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+# LRU acotado y seguro entre hilos (el buffer de ingesta escribe desde un hilo)
+class RecentKeys:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def add(self, key, value=True):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+recent_readings = RecentKeys(RECENT_READING_KEYS)
+recent_requests = RecentKeys(RECENT_IDEMPOTENCY_KEYS)
+
+
+def reading_key(row):
+    return row["device_id"], row["recorded_at"]
+
+
+# Límite inferior de recorded_at que aún se puede deduplicar: más atrás las lecturas crudas
+# ya se compactaron en rollups (retención raw) o se borró su partición, así que un reintento
+# no se detectaría y volvería a sumarse a los rollups. None = sin límite.
+def dedup_horizon(now: datetime = None):
+    cutoffs = [tier_cutoff("raw", now)]
+    if partitions is not None:
+        cutoffs.append(retention_cutoff(now))
+    cutoffs = [cutoff for cutoff in cutoffs if cutoff is not None]
+    return max(cutoffs) if cutoffs else None
+
+
+# Separa las lecturas nuevas de las repetidas, por la clave natural (device_id, recorded_at):
+# primero dentro del propio lote, luego contra las claves recientes en memoria y por último
+# con un SELECT sobre el índice único y las horas archivadas. Las lecturas anteriores a
+# dedup_horizon las rechaza quien llama. Devuelve (nuevas, {posición: id existente o None}).
+def split_duplicates(db: Session, rows):
+    new = []
+    duplicates = {}
+    pending = {}
+    for position, row in enumerate(rows):
+        key = reading_key(row)
+        if key in pending or recent_readings.get(key):
+            duplicates[position] = None
+        else:
+            pending[key] = position
+    if pending:
+        existing = find_existing(db, list(pending))
+        for key, position in pending.items():
+            if key in existing:
+                duplicates[position] = existing[key]
+                recent_readings.add(key)
+            else:
+                new.append(rows[position])
+    return new, duplicates
+
+
+# Un IN de recorded_at por dispositivo: usa el índice único (device_id, recorded_at) y sale
+# bastante más barato de compilar y ejecutar que un IN de tuplas
+def find_existing(db: Session, keys):
+    by_device = {}
+    for device_id, recorded_at in keys:
+        by_device.setdefault(device_id, []).append(recorded_at)
+    found = {}
+    for device_id, stamps in by_device.items():
+        for start in range(0, len(stamps), LOOKUP_CHUNK_SIZE):
+            chunk = stamps[start:start + LOOKUP_CHUNK_SIZE]
+            stmt = select(SensorReading.id, SensorReading.recorded_at).where(
+                SensorReading.device_id == device_id, SensorReading.recorded_at.in_(chunk),
+            )
+            # Los meses ya movidos a su tabla (PARTITION_MODE=tables) no tienen el índice único
+            stmt = partition_scope(stmt, min(chunk), max(chunk) + timedelta(microseconds=1))
+            for reading_id, recorded_at in db.execute(stmt):
+                found[(device_id, recorded_at)] = reading_id
+    # Solo puede estar archivado lo anterior a archive_cutoff; con ARCHIVE_AFTER_DAYS=0 no se
+    # consulta sensor_chunks. Lo reciente que ya exista lo detectan el índice único y el savepoint.
+    cutoff = archive_cutoff()
+    if cutoff is not None:
+        missing = [key for key in keys if key not in found and key[1] < cutoff]
+        if missing:
+            found.update(find_archived(db, missing))
+    return found
+
+
+# Lo mismo en sensor_chunks. Primero se buscan, sin leer los datos, las horas archivadas
+# del rango (lo normal es que no haya ninguna) y solo se decodifican las que se piden.
+def find_archived(db: Session, keys):
+    wanted = set(keys)
+    hours = {(device_id, floor_hour(recorded_at)) for device_id, recorded_at in keys}
+    starts = [hour for _, hour in hours]
+    archived = [
+        (device_id, hour_start) for device_id, hour_start in db.execute(
+            select(ReadingChunk.device_id, ReadingChunk.hour_start).where(
+                ReadingChunk.device_id.in_({device_id for device_id, _ in hours}),
+                ReadingChunk.hour_start >= min(starts), ReadingChunk.hour_start <= max(starts),
+            )
+        )
+        if (device_id, hour_start) in hours
+    ]
+    found = {}
+    for start in range(0, len(archived), LOOKUP_CHUNK_SIZE):
+        stmt = select(ReadingChunk.device_id, ReadingChunk.data).where(
+            tuple_(ReadingChunk.device_id, ReadingChunk.hour_start).in_(archived[start:start + LOOKUP_CHUNK_SIZE]),
+        )
+        for device_id, data in db.execute(stmt):
+            for reading_id, recorded_at, _, _ in gorilla.decode(data):
+                if (device_id, recorded_at) in wanted:
+                    found[(device_id, recorded_at)] = reading_id
+    return found
+
+
+# Inserta fila a fila, cada una en su savepoint. Las que chocan con una lectura ya guardada
+# (un reintento concurrente que pasó también la comprobación) se saltan; cualquier otro
+# IntegrityError, como un dispositivo borrado entretanto, se propaga. Devuelve las insertadas.
+def insert_each(db: Session, rows):
+    inserted = []
+    for row in rows:
+        try:
+            with db.begin_nested():
+                db.execute(insert(SensorReading.__table__), [row])
+        except IntegrityError:
+            if not find_existing(db, [reading_key(row)]):
+                raise
+            logger.warning("Concurrent duplicate reading ignored: device %s at %s", *reading_key(row))
+            continue
+        inserted.append(row)
+    return inserted
+
+
+# Hook posterior al commit: las claves insertadas pasan al filtro de recientes
+def remember_readings(rows):
+    for row in rows:
+        recent_readings.add(reading_key(row))
+
+
+def request_hash(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def scoped_key(route: str, key: str) -> str:
+    return f"{route}:{key}"
+
+
+# Respuesta guardada para una Idempotency-Key: (status_code, body) o None. Con la misma
+# clave y otro cuerpo se lanza IdempotencyConflict. Sin db solo se mira la memoria.
+def lookup_response(db: Session, key: str, body_hash: str):
+    stored = recent_requests.get(key)
+    if stored is None:
+        if db is None:
+            return None
+        record = db.get(IdempotencyRecord, key)
+        if record is None:
+            return None
+        stored = (record.request_hash, record.status_code, record.response)
+        recent_requests.add(key, stored)
+    if stored[0] != body_hash:
+        raise IdempotencyConflict(key)
+    return stored[1], stored[2]
+
+
+# Guarda la respuesta en la misma transacción que las lecturas. Si dos reintentos llegan a
+# la vez, el flush del segundo choca con la clave primaria (IntegrityError) y quien llama
+# deshace también sus lecturas.
+def save_response(db: Session, key: str, body_hash: str, status_code: int, response):
+    db.add(IdempotencyRecord(key=key, request_hash=body_hash, status_code=status_code, response=response))
+    db.flush()
+
+
+# Tras el commit (o directamente con write-behind, que no tiene transacción en la petición)
+def remember_response(key: str, body_hash: str, status_code: int, response):
+    recent_requests.add(key, (body_hash, status_code, response))
+
+
+# Lee la cabecera Idempotency-Key de la petición. Devuelve (None, None) sin cabecera,
+# ((clave, hash del cuerpo), None) la primera vez y (..., respuesta original) en un reintento.
+async def check_request(request: Request, db: AsyncSession = None, route: str = None):
+    key = request.headers.get("idempotency-key")
+    if not key:
+        return None, None
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key too long (max {MAX_KEY_LENGTH} characters)")
+    key = scoped_key(route or request.url.path, key)
+    body_hash = request_hash(await request.body())
+    try:
+        if db is None:
+            stored = lookup_response(None, key, body_hash)
+        else:
+            stored = await db.run_sync(lookup_response, key, body_hash)
+    except IdempotencyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key already used with a different request body")
+    return (key, body_hash), replay(stored) if stored else None
+
+
+def replay(stored):
+    status_code, body = stored
+    return JSONResponse(status_code=status_code, content=body, headers={REPLAY_HEADER: "true"})
+
+
+def purge_expired(db: Session, now: datetime = None) -> int:
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+    deleted = db.execute(delete(IdempotencyRecord).where(IdempotencyRecord.created_at < cutoff)).rowcount
+    db.commit()
+    return deleted
+
+
+def run_purge():
+    db = SessionLocal()
+    try:
+        return purge_expired(db)
+    finally:
+        db.close()
+
+
+async def periodic_purge(interval: float = IDEMPOTENCY_PURGE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            deleted = await asyncio.to_thread(run_purge)
+            if deleted:
+                logger.info("Purged %d expired idempotency keys", deleted)
+        except Exception:
+            logger.exception("Idempotency key purge failed")
@@ -0,0 +1,113 @@
+import asyncio
+import itertools
+import logging
+import math
+import os
+from database import SessionLocal
+from sensor_ingest import bulk_insert_readings, readings_committed
+
+logger = logging.getLogger(__name__)
+
+# Configuración del buffer de escritura diferida (write-behind)
+WRITE_BEHIND_ENABLED = os.getenv("INGEST_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))
+QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "10000"))
+
+_STOP = object()
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class WriteBehindBuffer:
+    def __init__(self, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL, max_queue: int = QUEUE_MAX):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue = None
+        self._task = None
+        self._accepting = False
+        self._seq = itertools.count(1)
+
+    @property
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.flush_interval))
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._accepting = True
+        self._task = asyncio.create_task(self._run())
+
+    # Encola una fila y devuelve el número de secuencia asignado por el servidor
+    def submit(self, row: dict) -> int:
+        if not self._accepting:
+            raise IngestQueueFull("Ingest buffer is not accepting readings")
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            raise IngestQueueFull("Ingest queue is full")
+        return next(self._seq)
+
+    # Deja de aceptar lecturas y vacía la cola antes de salir
+    async def stop(self):
+        if not self._task:
+            return
+        self._accepting = False
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            stopping = False
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+
+            await asyncio.to_thread(self._write, batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        db = SessionLocal()
+        try:
+            new, _ = bulk_insert_readings(batch, db)
+            db.commit()
+            readings_committed(new)
+        except Exception:
+            db.rollback()
+            # Si falla el bloque, se reintenta fila a fila para no perder las válidas
+            logger.exception("Bulk flush of %d readings failed, retrying row by row", len(batch))
+            for row in batch:
+                try:
+                    new, _ = bulk_insert_readings([row], db)
+                    db.commit()
+                    readings_committed(new)
+                except Exception:
+                    db.rollback()
+                    logger.exception("Dropping unwritable reading %r", row)
+        finally:
+            db.close()
+
+
+ingest_buffer = WriteBehindBuffer()
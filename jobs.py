@@ -0,0 +1,281 @@
+import logging
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from fastapi import UploadFile
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# Carpeta donde se guardan las subidas hasta que el trabajo termina
+IMPORT_STORAGE_DIR = os.getenv("IMPORT_STORAGE_DIR", "uploads")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "500"))
+# Un trabajo "running" sin latido en este tiempo se considera abandonado
+JOB_STALE_AFTER = timedelta(seconds=int(os.getenv("JOB_STALE_AFTER", "300")))
+# Cada cuánto se buscan trabajos abandonados mientras la API está en marcha
+JOB_SWEEP_INTERVAL = float(os.getenv("JOB_SWEEP_INTERVAL", "60"))
+MAX_JOB_ERRORS = 1000
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+# Cada tipo de importación aporta cómo leer el archivo y cómo procesar un lote.
+#   iter_rows(path, options) -> (número de fila, fila) en orden creciente
+#   process_chunk(db, chunk, options) -> (filas correctas, [(fila, error), ...], datos)
+#   after_commit(datos) -> opcional, se llama cuando el lote ya está confirmado
+# process_chunk no hace commit: el lote y el checkpoint se confirman juntos.
+class JobProcessor:
+    def __init__(self, iter_rows, process_chunk, chunk_size: int = JOB_CHUNK_SIZE, after_commit=None):
+        self.iter_rows = iter_rows
+        self.process_chunk = process_chunk
+        self.chunk_size = chunk_size
+        self.after_commit = after_commit
+
+
+_processors = {}
+
+
+def register_processor(kind: str, processor: JobProcessor):
+    _processors[kind] = processor
+
+
+def job_to_dict(job: ImportJob):
+    end = job.finished_at or datetime.utcnow()
+    elapsed = (end - job.started_at).total_seconds() if job.started_at else 0
+    processed = job.rows_done + job.rows_failed
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "filename": job.filename,
+        "status": job.status,
+        "rows_done": job.rows_done,
+        "rows_failed": job.rows_failed,
+        "checkpoint_row": job.checkpoint_row,
+        "rows_per_second": round(processed / elapsed, 1) if elapsed else None,
+        "errors": job.errors or [],
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+
+# Guarda la subida en IMPORT_STORAGE_DIR (sobrevive a un reinicio, a diferencia del UploadFile)
+async def store_upload(file: UploadFile, job_id: str) -> str:
+    os.makedirs(IMPORT_STORAGE_DIR, exist_ok=True)
+    extension = os.path.splitext(file.filename or "")[1]
+    path = os.path.join(IMPORT_STORAGE_DIR, job_id + extension)
+    with open(path, "wb") as out:
+        while chunk := await file.read(1024 * 1024):
+            out.write(chunk)
+    return path
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+# False solo si el worker ("host:pid") es de esta máquina y su proceso ya no existe. En
+# Windows os.kill(pid, 0) enviaría CTRL_C_EVENT, así que allí se espera al latido.
+def _worker_alive(worker: str) -> bool:
+    host, _, pid = (worker or "").rpartition(":")
+    if os.name == "nt" or host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._sweeper = None
+        self._stopping = threading.Event()
+        # Trabajos enviados al executor de este proceso que aún no han terminado
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._stopping.clear()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="import-job")
+        self.sweep()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name="import-job-sweeper", daemon=True)
+        self._sweeper.start()
+
+    # Los trabajos en curso se detienen en el siguiente límite de lote y vuelven a "queued"
+    def stop(self):
+        self._stopping.set()
+        if self._sweeper:
+            self._sweeper.join(timeout=5)
+            self._sweeper = None
+        if self._executor:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, job_id: str, dead_worker: str = None):
+        if self._executor is None:
+            raise RuntimeError("Job runner is not started")
+        with self._lock:
+            self._active.add(job_id)
+        self._executor.submit(self.run, job_id, dead_worker)
+
+    # Reanuda los trabajos pendientes, los abandonados (sin latido en JOB_STALE_AFTER) y los
+    # de un proceso anterior de esta máquina que ya no existe: tras una caída y un reinicio
+    # rápido no hay que esperar a que caduque su latido
+    def sweep(self):
+        db = SessionLocal()
+        try:
+            jobs = db.execute(
+                select(ImportJob.id, ImportJob.status, ImportJob.worker, ImportJob.heartbeat_at)
+                .where(ImportJob.status.in_(("queued", "running")))
+            ).all()
+        finally:
+            db.close()
+        cutoff = datetime.utcnow() - JOB_STALE_AFTER
+        resumed = 0
+        for job_id, status, worker, heartbeat_at in jobs:
+            with self._lock:
+                if job_id in self._active:
+                    continue
+            if status == "queued" or heartbeat_at is not None and heartbeat_at < cutoff:
+                self.submit(job_id)
+            elif worker != WORKER_ID and not _worker_alive(worker):
+                self.submit(job_id, dead_worker=worker)
+            else:
+                continue
+            resumed += 1
+        return resumed
+
+    def _sweep_loop(self):
+        while not self._stopping.wait(JOB_SWEEP_INTERVAL):
+            try:
+                resumed = self.sweep()
+                if resumed:
+                    logger.info("Resumed %d abandoned import jobs", resumed)
+            except Exception:
+                logger.exception("Import job sweep failed")
+
+    # Vuelve a encolar un trabajo fallido; continúa desde su último checkpoint
+    def resume(self, db: Session, job_id: str) -> bool:
+        result = db.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.status == "failed")
+            .values(status="queued", finished_at=None)
+        )
+        db.commit()
+        if result.rowcount != 1:
+            return False
+        self.submit(job_id)
+        return True
+
+    def create(self, db: Session, kind: str, path: str, filename: str = None, options: dict = None, job_id: str = None) -> ImportJob:
+        if kind not in _processors:
+            raise ValueError(f"Unknown import kind: {kind}")
+        job = ImportJob(id=job_id or new_job_id(), kind=kind, path=path, filename=filename,
+                        options=options or {}, status="queued", errors=[])
+        db.add(job)
+        db.commit()
+        return job
+
+    # Reclama el trabajo con un UPDATE condicional para que solo un worker lo procese.
+    # dead_worker: worker de esta máquina cuyo proceso ya no existe (ver sweep)
+    def _claim(self, db: Session, job_id: str, dead_worker: str = None) -> bool:
+        now = datetime.utcnow()
+        claimable = [
+            ImportJob.status == "queued",
+            (ImportJob.status == "running") & (ImportJob.heartbeat_at < now - JOB_STALE_AFTER),
+        ]
+        if dead_worker:
+            claimable.append((ImportJob.status == "running") & (ImportJob.worker == dead_worker))
+        result = db.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id)
+            .where(or_(*claimable))
+            .values(status="running", worker=WORKER_ID, heartbeat_at=now)
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def run(self, job_id: str, dead_worker: str = None):
+        try:
+            self._run(job_id, dead_worker)
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+
+    def _run(self, job_id: str, dead_worker: str = None):
+        db = SessionLocal()
+        try:
+            if not self._claim(db, job_id, dead_worker):
+                return
+            job = db.get(ImportJob, job_id)
+            if job.started_at is None:
+                job.started_at = datetime.utcnow()
+                db.commit()
+            self._process(db, job)
+        except Exception as e:
+            db.rollback()
+            logger.exception("Import job %s failed", job_id)
+            job = db.get(ImportJob, job_id)
+            if job is not None:
+                job.status = "failed"
+                job.errors = (job.errors or []) + [{"row": None, "error": str(e)}]
+                job.finished_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+    def _process(self, db: Session, job: ImportJob):
+        processor = _processors[job.kind]
+        options = job.options or {}
+        chunk = []
+        for number, row in processor.iter_rows(job.path, options):
+            # Las filas ya confirmadas en una ejecución anterior se saltan
+            if number <= job.checkpoint_row:
+                continue
+            chunk.append((number, row))
+            if len(chunk) >= processor.chunk_size:
+                self._commit_chunk(db, job, processor, chunk, options)
+                chunk = []
+                if self._stopping.is_set():
+                    job.status = "queued"
+                    db.commit()
+                    return
+        if chunk:
+            self._commit_chunk(db, job, processor, chunk, options)
+
+        job.status = "completed"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+    def _commit_chunk(self, db: Session, job: ImportJob, processor: JobProcessor, chunk, options):
+        done, errors, committed = processor.process_chunk(db, chunk, options)
+        job.rows_done += done
+        job.rows_failed += len(errors)
+        if errors and len(job.errors or []) < MAX_JOB_ERRORS:
+            room = MAX_JOB_ERRORS - len(job.errors or [])
+            job.errors = (job.errors or []) + [{"row": row, "error": error} for row, error in errors[:room]]
+        job.checkpoint_row = chunk[-1][0]
+        job.heartbeat_at = datetime.utcnow()
+        # Datos del lote y checkpoint en la misma transacción
+        db.commit()
+        if processor.after_commit is not None:
+            processor.after_commit(committed)
+
+
+job_runner = JobRunner()
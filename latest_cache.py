@@ -0,0 +1,56 @@
+import threading
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+from models import SensorReading
+from partitions import partition_scope
+
+
+# Última lectura conocida de cada dispositivo, en memoria del proceso
+class LatestReadingCache:
+    def __init__(self):
+        self._latest = {}
+        self._lock = threading.Lock()
+
+    def update(self, rows):
+        with self._lock:
+            for row in rows:
+                current = self._latest.get(row["device_id"])
+                if current is None or row["recorded_at"] >= current["recorded_at"]:
+                    self._latest[row["device_id"]] = {
+                        "device_id": row["device_id"],
+                        "temperature": row["temperature"],
+                        "humidity": row["humidity"],
+                        "recorded_at": row["recorded_at"],
+                    }
+
+    def discard(self, device_id: int):
+        with self._lock:
+            self._latest.pop(device_id, None)
+
+    def snapshot(self):
+        with self._lock:
+            return [self._latest[device_id] for device_id in sorted(self._latest)]
+
+    # Carga inicial: una consulta GROUP BY sobre el índice (device_id, recorded_at)
+    def warm(self, db: Session):
+        newest = (
+            select(SensorReading.device_id, func.max(SensorReading.recorded_at).label("recorded_at"))
+            .group_by(SensorReading.device_id)
+            .subquery()
+        )
+        rows = db.execute(partition_scope(
+            select(SensorReading.device_id, SensorReading.temperature,
+                   SensorReading.humidity, SensorReading.recorded_at)
+            .join(newest, and_(
+                SensorReading.device_id == newest.c.device_id,
+                SensorReading.recorded_at == newest.c.recorded_at,
+            ))
+            .order_by(SensorReading.id)
+        )).mappings().all()
+        with self._lock:
+            self._latest.clear()
+        self.update(rows)
+        return len(rows)
+
+
+latest_readings = LatestReadingCache()
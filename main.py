@@ -1,17 +1,85 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Header
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Request, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware  # Import CORS middleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import engine, SessionLocal, Base
-from models import User, Hamster, Device, SensorDataOut, SensorReading  # Asegúrate de tener 'SensorReading' en models
-from auth import create_token, verify_token, get_db
-from utils import hash_password, verify_password
-from excel_import import import_excel
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import engine, async_engine, SessionLocal, AsyncSessionLocal, Base
+from pool_metrics import pool_metrics, async_pool_metrics
+from models import User, Hamster, Device, SensorPage, SensorReading, SensorDataIn, LatestReadingOut, ImportJob  # Asegúrate de tener 'SensorReading' en models
+from auth import create_token, get_db, get_async_db, current_user, optional_user, user_from_token, require_role, owner_scope, scope_to_owner, can_access, CurrentUser, auth_cache_stats
+from password_pool import password_pool
+from excel_import import shutdown_executor as shutdown_import_executor
+from jobs import job_runner, job_to_dict, store_upload, new_job_id
+from sensor_import import detect_format
+from sensor_ingest import ingest_batch, insert_reading, reading_row, readings_committed
+from idempotency import check_request, save_response, remember_response, recent_readings, recent_requests, reading_key, periodic_purge, dedup_horizon, EXPIRED_ERROR
+from latest_cache import latest_readings
+from device_cache import known_devices
+from realtime import hub, SSE_KEEPALIVE
+from sensor_queries import sensor_page_query, encode_cursor, decode_cursor, clamp_limit, DEFAULT_PAGE_LIMIT
+from sensor_export import iter_sensor_export, EXPORT_MEDIA_TYPES
+from aggregates import aggregate_readings
+from rollups import periodic_catch_up, ROLLUP_MODE
+from response_cache import response_cache
+from fast_json import ORJSONResponse
+from sensor_formats import negotiate, page_response, PAGE_FIELDS
+from compression import CompressionMiddleware
+from partitions import run_maintenance, periodic_maintenance, partitions
+from retention import periodic_retention, retention_enabled
+from archive import ARCHIVE_AFTER_DAYS, archived_page, merge_pages, periodic_archive
+from ingest_buffer import ingest_buffer, IngestQueueFull, WRITE_BEHIND_ENABLED
 import uvicorn
 from pydantic import BaseModel
-from typing import List  # Importar List para usarlo como tipo de datos en la respuesta
+from typing import List, Optional, Literal  # Importar List para usarlo como tipo de datos en la respuesta
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
+import asyncio
+import os
+
+def warm_latest_readings():
+    db = SessionLocal()
+    try:
+        latest_readings.warm(db)
+    finally:
+        db.close()
+
+# Arranque y apagado: el buffer de ingesta se vacía antes de cerrar
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Las particiones se ponen al día antes de leer nada (la caché ya consulta los meses movidos)
+    if partitions is not None:
+        await asyncio.to_thread(run_maintenance)
+    await asyncio.to_thread(warm_latest_readings)
+    await hub.start()
+    await asyncio.to_thread(job_runner.start)
+    if WRITE_BEHIND_ENABLED:
+        await ingest_buffer.start()
+    rollup_task = asyncio.create_task(periodic_catch_up()) if ROLLUP_MODE == "periodic" else None
+    partition_task = asyncio.create_task(periodic_maintenance()) if partitions is not None else None
+    retention_task = asyncio.create_task(periodic_retention()) if retention_enabled() else None
+    archive_task = asyncio.create_task(periodic_archive()) if ARCHIVE_AFTER_DAYS > 0 else None
+    idempotency_task = asyncio.create_task(periodic_purge())
+    yield
+    await ingest_buffer.stop()
+    if rollup_task:
+        rollup_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await rollup_task
+    for task in (partition_task, retention_task, archive_task, idempotency_task):
+        if task:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    await hub.stop()
+    await asyncio.to_thread(password_pool.shutdown)
+    await asyncio.to_thread(job_runner.stop)
+    await asyncio.to_thread(shutdown_import_executor)
 
 # ✅ Instancia principal
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configurar CORS (permitir solicitudes de tu frontend)
 app.add_middleware(
@@ -22,13 +90,23 @@ app.add_middleware(
     allow_headers=["*"],  # Permitir todos los encabezados
 )
 
+# Compresión gzip/br/zstd según Accept-Encoding; umbral por prefijo de ruta (None = sin comprimir)
+app.add_middleware(CompressionMiddleware, routes={
+    "/sensores/export": 0,  # exportaciones grandes en streaming: se comprime desde el primer lote
+    "/metrics": None,
+})
+
 # Inicializar la base de datos
 Base.metadata.create_all(bind=engine)
 
+# Listados que cambian poco: respuesta en caché con ETag; If-None-Match -> 304
 @app.get("/users")
-def get_users(db: Session = Depends(get_db)):
+def get_users(request: Request, db: Session = Depends(get_db), admin: CurrentUser = Depends(require_role("admin"))):
+    etag, cached = response_cache.lookup(request, "users", ("users",))
+    if cached:
+        return cached
     users = db.query(User).all()
-    return users
+    return response_cache.store(etag, users, ttl=300)
 
 class UserRegister(BaseModel):
     name: str
@@ -37,14 +115,17 @@ class UserRegister(BaseModel):
     rol: str = "normal"
 
 @app.post("/register")
-def register(user: UserRegister, db: Session = Depends(get_db)):
+async def register(user: UserRegister, db: AsyncSession = Depends(get_async_db), caller: Optional[CurrentUser] = Depends(optional_user)):
     if user.rol not in ['admin', 'normal']:
         raise HTTPException(status_code=400, detail="Invalid rol. Must be 'admin' or 'normal'.")
-    
-    hashed_password = hash_password(user.password)
-    new_user = User(name=user.name, email=user.email, password=hashed_password, rol=user.rol)
+    # El registro es público: solo un admin autenticado puede elegir el rol
+    rol = user.rol if caller is not None and caller.rol == "admin" else "normal"
+
+    hashed_password = await password_pool.hash(user.password)
+    new_user = User(name=user.name, email=user.email, password=hashed_password, rol=rol)
     db.add(new_user)
-    db.commit()
+    await db.commit()
+    response_cache.invalidate("users")
 
     return {"message": "User registered"}
 
@@ -52,68 +133,220 @@ class UserLogin(BaseModel):
     email: str
     password: str
 
-@app.post("/login")
-def login(user: UserLogin, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def authenticate(email: str, password: str, db: AsyncSession) -> str:
+    result = await db.execute(select(User).where(User.email == email))
+    db_user = result.scalars().first()
     
-    if not db_user or not verify_password(user.password, db_user.password):
+    if not db_user or not await password_pool.verify(password, db_user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    token = create_token({"id": db_user.id, "email": db_user.email, "rol": db_user.rol})
-    return {"token": token}
+    return create_token({"id": db_user.id, "email": db_user.email, "rol": db_user.rol})
 
-@app.get("/profile")
-def get_profile(
-    authorization: str = Header(None),  # Extraer el encabezado Authorization
-    db: Session = Depends(get_db)
+@app.post("/login")
+async def login(user: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    return {"token": await authenticate(user.email, user.password, db)}
+
+# Login en formato OAuth2 (formulario username/password), usado por /docs
+@app.post("/token")
+async def login_for_access_token(form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
+    return {"access_token": await authenticate(form.username, form.password, db), "token_type": "bearer"}
+
+@app.get("/profile", response_model=CurrentUser)
+async def get_profile(user: CurrentUser = Depends(current_user)):
+    return user
+
+# Un trabajo solo lo ve quien lo creó (o un admin)
+def get_job_or_404(db: Session, job_id: str, user: CurrentUser) -> ImportJob:
+    job = db.get(ImportJob, job_id)
+    if not job or (user.rol != "admin" and (job.options or {}).get("requested_by") != user.id):
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+# Importaciones masivas: se guarda el archivo y un worker lo procesa por lotes con checkpoint
+@app.post("/imports", status_code=202)
+async def create_import(
+    kind: str = "users",
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    admin: CurrentUser = Depends(require_role("admin"))
 ):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Token no proporcionado o inválido")
-    
-    token = authorization.split("Bearer ")[1]
-    
+    job_id = new_job_id()
+    path = await store_upload(file, job_id)
     try:
-        payload = verify_token(token)
-        user = db.query(User).filter(User.id == payload["id"]).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="Usuario no encontrado")
-        
-        return user
-    except Exception as e:
-        raise HTTPException(status_code=401, detail="Token inválido o expirado")
+        job = job_runner.create(db, kind, path, filename=file.filename,
+                                options={"requested_by": admin.id}, job_id=job_id)
+    except ValueError as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+    job_runner.submit(job.id)
+    return {"message": "Import queued", "job_id": job.id}
 
-@app.post("/import-excel")
-async def upload_excel(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    return await import_excel(file, db)
+@app.get("/imports/{job_id}")
+def get_import(job_id: str, db: Session = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    return job_to_dict(get_job_or_404(db, job_id, user))
+
+@app.post("/imports/{job_id}/resume")
+def resume_import(job_id: str, db: Session = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    get_job_or_404(db, job_id, user)
+    if not job_runner.resume(db, job_id):
+        raise HTTPException(status_code=409, detail="Only failed imports can be resumed")
+    return {"message": "Import resumed", "job_id": job_id}
+
+# Compatibilidad: /import-excel es una importación de usuarios
+@app.post("/import-excel", status_code=202)
+async def upload_excel(
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+    admin: CurrentUser = Depends(require_role("admin"))
+):
+    return await create_import("users", file, db, admin)
+
+@app.get("/import-excel/{job_id}")
+def get_import_status(job_id: str, db: Session = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    return get_import(job_id, db, user)
 
 @app.get("/hamsters")
-def get_hamsters(db: Session = Depends(get_db)):
-    hamsters = db.query(Hamster).all()
-    return hamsters
+def get_hamsters(request: Request, db: Session = Depends(get_db), user: CurrentUser = Depends(current_user)):
+    etag, cached = response_cache.lookup(request, "hamsters", ("hamsters",), owner_scope(user))
+    if cached:
+        return cached
+    hamsters = db.scalars(scope_to_owner(select(Hamster), Hamster, user)).all()
+    return response_cache.store(etag, hamsters, ttl=60)
 
 @app.get("/devices")
-def get_devices(db: Session = Depends(get_db)):
-    return db.query(Device).all()
+async def get_devices(request: Request, db: AsyncSession = Depends(get_async_db), user: CurrentUser = Depends(current_user)):
+    etag, cached = response_cache.lookup(request, "devices", ("devices",), owner_scope(user))
+    if cached:
+        return cached
+    result = await db.execute(scope_to_owner(select(Device), Device, user))
+    return response_cache.store(etag, result.scalars().all(), ttl=60)
 
-@app.get("/devices/{device_id}")
-def get_device(device_id: int, db: Session = Depends(get_db)):
-    device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
+# Última lectura de cada dispositivo desde la caché en memoria (no consulta sensor_readings)
+@app.get("/devices/latest", response_model=List[LatestReadingOut])
+async def get_devices_latest(db: AsyncSession = Depends(get_async_db), user: CurrentUser = Depends(current_user)):
+    snapshot = latest_readings.snapshot()
+    if owner_scope(user) is None:
+        return ORJSONResponse(snapshot)
+    owned = set((await db.scalars(scope_to_owner(select(Device.id), Device, user))).all())
+    return ORJSONResponse([reading for reading in snapshot if reading["device_id"] in owned])
+
+# Dispositivos de otros usuarios responden 404, igual que si no existieran
+async def get_owned_device(device_id: int, db: AsyncSession, user: CurrentUser) -> Device:
+    device = await db.get(Device, device_id)
+    if not device or not can_access(device, user):
         raise HTTPException(status_code=404, detail="Device not found")
     return device
 
+@app.get("/devices/{device_id}")
+async def get_device(device_id: int, db: AsyncSession = Depends(get_async_db), user: CurrentUser = Depends(current_user)):
+    return await get_owned_device(device_id, db, user)
+
+# Agregados min/max/media por bucket de tiempo (5m, 1h, 1d...) calculados en la base de datos
+@app.get("/devices/{device_id}/readings/aggregate")
+async def get_device_aggregate(
+    device_id: int,
+    bucket: str = "5m",
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db),
+    user: CurrentUser = Depends(current_user)
+):
+    await get_owned_device(device_id, db, user)
+    return ORJSONResponse(await db.run_sync(aggregate_readings, device_id, bucket, from_, to))
+
+# Lecturas en tiempo real de un dispositivo por WebSocket. Los navegadores no pueden
+# enviar Authorization en el handshake, así que el token va en ?token=
+@app.websocket("/ws/devices/{device_id}")
+async def device_readings_ws(websocket: WebSocket, device_id: int, token: Optional[str] = None):
+    # Sesión corta: no se retiene una conexión del pool mientras dure el socket
+    try:
+        async with AsyncSessionLocal() as db:
+            user = await user_from_token(token, db)
+            await get_owned_device(device_id, db, user)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = hub.subscribe(device_id)
+
+    async def send_readings():
+        while True:
+            await websocket.send_text(await subscription.get())
+
+    # El envío va en otra tarea y aquí se lee el socket: el cierre del cliente se ve al
+    # momento aunque el dispositivo no mande nada (los mensajes del cliente se ignoran)
+    sender = asyncio.create_task(send_readings())
+    try:
+        while not sender.done():
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        sender.cancel()
+        with suppress(asyncio.CancelledError, WebSocketDisconnect, RuntimeError):
+            await sender
+        hub.unsubscribe(subscription)
+
+# Equivalente con Server-Sent Events
+@app.get("/devices/{device_id}/stream")
+async def device_readings_sse(
+    device_id: int,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    user: CurrentUser = Depends(current_user)
+):
+    await get_owned_device(device_id, db, user)
+    # Devuelve la conexión al pool antes de empezar el stream
+    await db.close()
+    subscription = hub.subscribe(device_id)
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    message = await asyncio.wait_for(subscription.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            hub.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.post("/devices")
-def add_device(device_name: str, location: str = None, user_id: int = None, db: Session = Depends(get_db)):
+def add_device(
+    device_name: str,
+    location: str = None,
+    user_id: int = None,
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(current_user)
+):
+    # Solo un admin puede crear dispositivos a nombre de otro usuario
+    if user_id is None:
+        user_id = user.id
+    elif user_id != user.id and user.rol != "admin":
+        raise HTTPException(status_code=403, detail="Not enough permissions")
     device = Device(device_name=device_name, location=location, user_id=user_id)
     db.add(device)
     db.commit()
+    response_cache.invalidate("devices")
     db.refresh(device)
+    known_devices.add(device.id)
     return {"message": "Device added successfully", "deviceId": device.id}
 
 @app.put("/devices/{device_id}")
-def update_device(device_id: int, device_name: str = None, location: str = None, db: Session = Depends(get_db)):
+def update_device(
+    device_id: int,
+    device_name: str = None,
+    location: str = None,
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(current_user)
+):
     device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
+    if not device or not can_access(device, user):
         raise HTTPException(status_code=404, detail="Device not found")
     
     if device_name:
@@ -122,75 +355,224 @@ def update_device(device_id: int, device_name: str = None, location: str = None,
         device.location = location
     
     db.commit()
+    response_cache.invalidate("devices")
     db.refresh(device)
     return {"message": "Device updated successfully"}
 
 @app.delete("/devices/{device_id}")
-def delete_device(device_id: int, db: Session = Depends(get_db)):
+def delete_device(device_id: int, db: Session = Depends(get_db), user: CurrentUser = Depends(current_user)):
     device = db.query(Device).filter(Device.id == device_id).first()
-    if not device:
+    if not device or not can_access(device, user):
         raise HTTPException(status_code=404, detail="Device not found")
     
     db.delete(device)
     db.commit()
+    response_cache.invalidate("devices")
+    latest_readings.discard(device_id)
+    known_devices.discard(device_id)
     return {"message": "Device deleted successfully"}
 @app.get("/")
 def read_root():
     return {"message": "API running!"}
 
+# Métricas internas, solo para admin
+# Estado del pool de conexiones: en uso, overflow e histograma de espera
+@app.get("/metrics/db-pool")
+def get_db_pool_metrics(admin: CurrentUser = Depends(require_role("admin"))):
+    return {
+        "sync": pool_metrics.snapshot(engine.pool),
+        "async": async_pool_metrics.snapshot(async_engine.pool),
+    }
+
+# Cola y latencia del pool de procesos de bcrypt
+@app.get("/metrics/password-hashing")
+def get_password_hashing_metrics(admin: CurrentUser = Depends(require_role("admin"))):
+    return password_pool.stats()
+
+# Aciertos de las cachés de tokens y usuarios
+@app.get("/metrics/auth-cache")
+def get_auth_cache_metrics(admin: CurrentUser = Depends(require_role("admin"))):
+    return auth_cache_stats()
+
+# Aciertos y 304 de la caché de respuestas
+@app.get("/metrics/response-cache")
+def get_response_cache_metrics(admin: CurrentUser = Depends(require_role("admin"))):
+    return response_cache.stats()
+
+# Reintentos cortados en memoria antes de llegar a la base de datos
+@app.get("/metrics/ingest-dedup")
+def get_ingest_dedup_metrics(admin: CurrentUser = Depends(require_role("admin"))):
+    return {"readings": recent_readings.stats(), "idempotency_keys": recent_requests.stats(), "known_devices": known_devices.stats()}
+
 @app.get("/blog")
 def get_blog():
     return {"message": "Blog page - No content yet"}
 
-@app.get("/sensores", response_model=List[SensorDataOut])
-def get_sensores(db: Session = Depends(get_db)):
-    sensores = db.query(SensorReading).all()
-    
-    if not sensores:
+@app.get("/sensores", response_model=SensorPage)
+async def get_sensores(
+    request: Request,
+    device_id: Optional[int] = None,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1),
+    db: AsyncSession = Depends(get_async_db),
+    user: CurrentUser = Depends(current_user)
+):
+    limit = clamp_limit(limit)
+    media_type = negotiate(request.headers.get("accept"))
+    stmt = sensor_page_query(
+        [getattr(SensorReading, field) for field in PAGE_FIELDS],
+        device_id, from_, to, cursor, limit, owner_scope(user),
+    )
+    sensores = (await db.execute(stmt)).all()
+    # Las horas archivadas (sensor_chunks) se decodifican y se intercalan por (recorded_at, id)
+    archived = await db.run_sync(
+        archived_page, device_id, from_, to, owner_scope(user), decode_cursor(cursor) if cursor else None, limit,
+    )
+    sensores = merge_pages(sensores, archived, limit)
+
+    if not sensores and not cursor:
         raise HTTPException(status_code=404, detail="No se encontraron lecturas de sensores")
-    
-    return [
-        SensorDataOut(
-            id=sensor.id,  # Este es el campo 'id' de SensorReading
-            device_id=sensor.device_id,  # Asegúrate de usar 'device_id'
-            temperature=sensor.temperature,
-            humidity=sensor.humidity,
-            recorded_at=sensor.recorded_at
-        ) 
-        for sensor in sensores
-    ]
-
-class SensorDataIn(BaseModel):
-    device_id: int
-    temperature: float
-    humidity: float
+
+    next_cursor = None
+    if len(sensores) > limit:
+        sensores = sensores[:limit]
+        next_cursor = encode_cursor(sensores[-1].recorded_at, sensores[-1].id)
+
+    # Las tuplas se serializan directamente (sin modelos por fila); response_model queda para la
+    # documentación. Accept elige entre JSON por filas, JSON columnar, binario empaquetado o Arrow.
+    return page_response(media_type, sensores, next_cursor)
+
+# Exportación completa en streaming (NDJSON o CSV) con memoria constante
+@app.get("/sensores/export")
+def export_sensores(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    device_id: Optional[int] = None,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    user: CurrentUser = Depends(current_user),
+):
+    return StreamingResponse(
+        iter_sensor_export(format, device_id, from_, to, owner_scope(user)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="sensor_readings.{format}"'},
+    )
 
 @app.post("/sensor-data")
-async def create_sensor_data(sensor_data: SensorDataIn, db: Session = Depends(get_db)):
+async def create_sensor_data(sensor_data: SensorDataIn, request: Request, db: AsyncSession = Depends(get_async_db)):
     # Validar que los campos no estén vacíos (aunque FastAPI los validará a través de Pydantic)
     if not sensor_data.device_id or not sensor_data.temperature or not sensor_data.humidity:
         raise HTTPException(status_code=400, detail="Missing fields")
 
-    try:
-        # Crear un nuevo registro de lectura de sensor
-        new_sensor_data = SensorReading(
-            device_id=sensor_data.device_id,
-            temperature=sensor_data.temperature,
-            humidity=sensor_data.humidity
-        )
-        
-        # Agregar el nuevo registro a la base de datos
-        db.add(new_sensor_data)
-        db.commit()
-        db.refresh(new_sensor_data)
-
-        # Devolver el mensaje de éxito con el ID del nuevo registro
-        return {"message": "Data saved successfully", "id": new_sensor_data.id}
+    row = reading_row(sensor_data, datetime.utcnow())
+    horizon = dedup_horizon()
+    if horizon is not None and row["recorded_at"] < horizon:
+        raise HTTPException(status_code=400, detail=EXPIRED_ERROR)
+
+    # Con write-behind activo se responde 202 y la fila se escribe en el próximo flush. No hay
+    # transacción en la petición: los reintentos se cortan con las claves recientes en memoria
+    # y el flush descarta el resto por (device_id, recorded_at).
+    if WRITE_BEHIND_ENABLED:
+        idempotency, replayed = await check_request(request)
+        if replayed:
+            return replayed
+        if recent_readings.get(reading_key(row)):
+            return {"message": "Duplicate reading ignored", "duplicate": True}
+        # El flush no puede devolver errores al cliente: el dispositivo se comprueba antes del 202
+        if not await known_devices.exists(row["device_id"], db):
+            raise HTTPException(status_code=404, detail="Device not found")
+        try:
+            sequence = ingest_buffer.submit(row)
+        except IngestQueueFull:
+            raise HTTPException(
+                status_code=429,
+                detail="Ingest queue full, retry later",
+                headers={"Retry-After": str(ingest_buffer.retry_after)},
+            )
+        content = {"message": "Data accepted", "sequence": sequence}
+        if idempotency:
+            remember_response(*idempotency, 202, content)
+        return JSONResponse(status_code=202, content=content)
 
+    idempotency, replayed = await check_request(request, db)
+    if replayed:
+        return replayed
+    try:
+        # Si ya existe una lectura del dispositivo con ese recorded_at se devuelve su id
+        reading_id, duplicate = await db.run_sync(insert_reading, row)
+        content = {
+            "message": "Duplicate reading ignored" if duplicate else "Data saved successfully",
+            "id": reading_id,
+            "duplicate": duplicate,
+        }
+        if idempotency:
+            await db.run_sync(save_response, *idempotency, 200, content)
+        await db.commit()
+    except IntegrityError:
+        # Otro reintento con la misma Idempotency-Key terminó antes
+        await db.rollback()
+        if idempotency:
+            _, replayed = await check_request(request, db)
+            if replayed:
+                return replayed
+        raise HTTPException(status_code=500, detail="Error saving data")
     except Exception as e:
         # Manejar el error en caso de una excepción
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error saving data: {str(e)}")
 
+    if not duplicate:
+        readings_committed([row])
+    if idempotency:
+        remember_response(*idempotency, 200, content)
+    return content
+
+# Carga por lotes: array JSON o NDJSON (Content-Type: application/x-ndjson).
+# Las lecturas repetidas por (device_id, recorded_at) salen como "duplicate" en results.
+@app.post("/sensor-data/batch")
+async def create_sensor_data_batch(request: Request, db: AsyncSession = Depends(get_async_db)):
+    idempotency, replayed = await check_request(request, db)
+    if replayed:
+        return replayed
+    body = await request.body()
+
+    def save(sync_db, content):
+        if idempotency:
+            save_response(sync_db, *idempotency, 200, content)
+
+    try:
+        content = await db.run_sync(ingest_batch, body, request.headers.get("content-type", ""), save)
+    except IntegrityError:
+        if idempotency:
+            _, replayed = await check_request(request, db)
+            if replayed:
+                return replayed
+        raise HTTPException(status_code=500, detail="Error saving data")
+    if idempotency:
+        remember_response(*idempotency, 200, content)
+    return content
+
+# Backfill de lecturas desde CSV, XLSX o Parquet como trabajo de importación
+@app.post("/sensor-data/import", status_code=202)
+async def import_sensor_data(
+    file: UploadFile = File(...),
+    format: Optional[Literal["csv", "xlsx", "parquet"]] = None,
+    db: Session = Depends(get_db),
+    user: CurrentUser = Depends(current_user)
+):
+    try:
+        fmt = detect_format(file.filename, format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    job_id = new_job_id()
+    path = await store_upload(file, job_id)
+    job = job_runner.create(db, "sensor_readings", path, filename=file.filename,
+                            options={"format": fmt, "user_id": owner_scope(user), "requested_by": user.id},
+                            job_id=job_id)
+    job_runner.submit(job.id)
+    return {"message": "Import queued", "job_id": job.id}
+
 # Ejecutar la API
 if __name__ == "__main__":
     uvicorn.run("main:app", host="localhost", port=8001, reload=True)
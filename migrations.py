@@ -0,0 +1,85 @@
+from sqlalchemy import inspect, text
+from database import engine, Base
+import models  # noqa: F401  (registra las tablas en Base.metadata)
+
+# create_all solo crea tablas nuevas; los índices añadidos a tablas
+# existentes hay que crearlos aparte. Ejecutar: python migrations.py
+
+
+# Crea los índices declarados en los modelos que falten en la base de datos
+def ensure_indexes(bind=engine):
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind)
+                created.append(index.name)
+    return created
+
+
+# MySQL: columnas DATETIME creadas sin fsp (truncan a segundos) pasan a DATETIME(6),
+# en sensor_readings y en las tablas por mes de PARTITION_MODE=tables. Conserva NULL/NOT NULL.
+def ensure_datetime_precision(bind=engine):
+    if bind.dialect.name != "mysql":
+        return []
+    with bind.begin() as conn:
+        columns = conn.execute(text(
+            "SELECT TABLE_NAME, IS_NULLABLE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND COLUMN_NAME = 'recorded_at' AND DATA_TYPE = 'datetime' "
+            "AND DATETIME_PRECISION < 6 AND (TABLE_NAME = 'sensor_readings' OR TABLE_NAME LIKE 'sensor\\_readings\\_p%')"
+        )).all()
+        for table_name, nullable in columns:
+            null = "NULL" if nullable == "YES" else "NOT NULL"
+            conn.execute(text(f"ALTER TABLE {table_name} MODIFY recorded_at DATETIME(6) {null}"))
+    return [f"{table_name}.recorded_at" for table_name, _ in columns]
+
+
+# Índices que pasaron a ser únicos. No se borra nada: si hay claves repetidas se
+# informa y el índice se queda como estaba hasta resolverlas a mano.
+# Devuelve {índice: claves repetidas} (0 = reconstruido como único).
+def ensure_unique_indexes(bind=engine):
+    inspector = inspect(bind)
+    tables = set(inspector.get_table_names())
+    result = {}
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"]: index for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if not index.unique or index.name not in existing or existing[index.name]["unique"]:
+                continue
+            columns = ", ".join(column.name for column in index.columns)
+            with bind.begin() as conn:
+                conflicts = conn.scalar(text(
+                    f"SELECT COUNT(*) FROM (SELECT 1 FROM {table.name} "
+                    f"GROUP BY {columns} HAVING COUNT(*) > 1) AS repeated"
+                ))
+                if not conflicts:
+                    if bind.dialect.name == "mysql":
+                        conn.execute(text(f"DROP INDEX {index.name} ON {table.name}"))
+                    else:
+                        conn.execute(text(f"DROP INDEX {index.name}"))
+                    index.create(conn)
+            result[index.name] = conflicts
+    return result
+
+
+def upgrade(bind=engine):
+    Base.metadata.create_all(bind=bind)
+    altered = [f"{column} (DATETIME(6))" for column in ensure_datetime_precision(bind)]
+    rebuilt = ensure_unique_indexes(bind)
+    unique = [
+        f"{name} (unique)" if not conflicts else f"{name} NOT rebuilt: {conflicts} repeated keys, resolve them and run again"
+        for name, conflicts in rebuilt.items()
+    ]
+    return altered + ensure_indexes(bind) + unique
+
+
+if __name__ == "__main__":
+    created = upgrade()
+    print("Applied: " + (", ".join(created) if created else "none"))
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, TIMESTAMP, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, Float, DateTime, TIMESTAMP, Enum, Index, JSON, LargeBinary
+from sqlalchemy.dialects import mysql
 from sqlalchemy.orm import relationship
 from database import Base
 from pydantic import BaseModel
 from datetime import datetime
+from typing import List, Optional
 from sqlalchemy.sql import func
 
 # Definición de la tabla User
@@ -29,6 +31,18 @@ class SensorDataOut(BaseModel):
     class Config:
         orm_mode = True  
 
+# Página de lecturas con cursor opaco para pedir la siguiente
+class SensorPage(BaseModel):
+    items: List[SensorDataOut]
+    next_cursor: Optional[str] = None
+
+# Última lectura de un dispositivo (caché en memoria)
+class LatestReadingOut(BaseModel):
+    device_id: int
+    temperature: float
+    humidity: float
+    recorded_at: datetime
+
 class Device(Base):
     __tablename__ = 'devices'
     
@@ -61,17 +75,99 @@ class Hamster(Base):
 
 class SensorReading(Base):
     __tablename__ = "sensor_readings"
+    # Índice compuesto para consultas por dispositivo y rango de tiempo. Es único: la clave
+    # natural (device_id, recorded_at) descarta las lecturas repetidas por reintentos.
+    __table_args__ = (
+        Index("ix_sensor_readings_device_recorded", "device_id", "recorded_at", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     device_id = Column(Integer, ForeignKey("devices.id"))
     temperature = Column(Float)
     humidity = Column(Float)
-    recorded_at = Column(DateTime, default=datetime.utcnow)
+    # En MySQL DATETIME sin fsp trunca a segundos y la clave única juntaría lecturas
+    # del mismo segundo: se guardan microsegundos (migrations.py altera las tablas viejas)
+    recorded_at = Column(DateTime().with_variant(mysql.DATETIME(fsp=6), "mysql"), default=datetime.utcnow)
 
     # Relación con Device, cambiando el nombre del backref
     device = relationship("Device", backref="sensor_readings_backref")
 
+# Resúmenes precalculados por dispositivo y bucket (1m, 1h, 1d)
+class SensorRollup(Base):
+    __tablename__ = "sensor_rollups"
+
+    device_id = Column(Integer, primary_key=True)
+    resolution = Column(String(4), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    temp_sum = Column(Float)
+    temp_min = Column(Float)
+    temp_max = Column(Float)
+    hum_sum = Column(Float)
+    hum_min = Column(Float)
+    hum_max = Column(Float)
+
+# Lecturas archivadas: una fila por dispositivo y hora con la serie comprimida (gorilla.py)
+class ReadingChunk(Base):
+    __tablename__ = "sensor_chunks"
+    __table_args__ = (
+        Index("ix_sensor_chunks_hour", "hour_start"),
+    )
+
+    device_id = Column(Integer, primary_key=True)
+    hour_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False)
+    # MEDIUMBLOB en MySQL: una hora a varias lecturas por segundo supera los 64 KB de BLOB
+    data = Column(LargeBinary(16 * 1024 * 1024), nullable=False)
+
+# Marca de agua del job de rollups periódico: last_id ya procesado,
+# pending_id es el máximo visto en la vuelta anterior
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    pending_id = Column(Integer, nullable=False, default=0)
+
+# Trabajos de importación masiva: el progreso se guarda por lotes para poder reanudar
+class ImportJob(Base):
+    __tablename__ = "import_jobs"
+
+    id = Column(String(32), primary_key=True)
+    kind = Column(String(30), nullable=False)
+    filename = Column(String(255))
+    path = Column(String(500), nullable=False)
+    options = Column(JSON)
+    status = Column(String(20), nullable=False, default="queued", index=True)
+    rows_done = Column(Integer, nullable=False, default=0)
+    rows_failed = Column(Integer, nullable=False, default=0)
+    # Última fila del archivo cuyo lote ya está confirmado
+    checkpoint_row = Column(Integer, nullable=False, default=0)
+    errors = Column(JSON)
+    worker = Column(String(100))
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+# Respuestas ya enviadas por Idempotency-Key, para repetirlas en los reintentos
+class IdempotencyRecord(Base):
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
 # Modelos de entrada (Pydantic models)
+class SensorDataIn(BaseModel):
+    device_id: int
+    temperature: float
+    humidity: float
+    # Hora de la medida según el dispositivo; sin ella se usa la del servidor
+    recorded_at: Optional[datetime] = None
+
 class SensorReadingCreate(BaseModel):
     device_id: int
     temperature: float
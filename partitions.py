@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timezone
+from sqlalchemy import inspect, select, table, column, text, union_all
+from sqlalchemy.sql.util import ClauseAdapter
+from database import engine
+from models import SensorReading
+
+logger = logging.getLogger(__name__)
+
+# off: sensor_readings es una tabla normal
+# native: particiones RANGE mensuales de MySQL sobre recorded_at
+# tables: una tabla por mes (sensor_readings_pYYYYMM) para SQLite; las escrituras van a
+#         sensor_readings y el mantenimiento mueve los meses cerrados a su tabla
+PARTITION_MODE = os.getenv("PARTITION_MODE", "off").lower()
+# Meses completos que se conservan además del actual; 0 conserva todo
+RETENTION_MONTHS = int(os.getenv("SENSOR_RETENTION_MONTHS", "0"))
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "3"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+TABLE = SensorReading.__tablename__
+UNION_VIEW = TABLE + "_all"
+MAX_PARTITION = "pmax"
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month: datetime) -> str:
+    return month.strftime("p%Y%m")
+
+
+def partition_month(name: str) -> datetime:
+    return datetime.strptime(name[-6:], "%Y%m")
+
+
+# Primer mes que se conserva: los anteriores se eliminan enteros
+def retention_cutoff(now: datetime = None):
+    if RETENTION_MONTHS <= 0:
+        return None
+    return add_months(month_start(now or datetime.utcnow()), -RETENTION_MONTHS)
+
+
+class MySQLPartitions:
+    def list(self, conn):
+        rows = conn.execute(text(
+            "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL "
+            "ORDER BY PARTITION_ORDINAL_POSITION"
+        ), {"table": TABLE}).all()
+        return [name for name, _ in rows]
+
+    # Conversión única. MySQL exige que la clave de partición forme parte de la clave
+    # primaria y no admite claves foráneas en tablas particionadas.
+    def convert(self, conn, now: datetime = None):
+        if self.list(conn):
+            return False
+        now = now or datetime.utcnow()
+        for foreign_key in inspect(conn).get_foreign_keys(TABLE):
+            conn.execute(text(f"ALTER TABLE {TABLE} DROP FOREIGN KEY `{foreign_key['name']}`"))
+        conn.execute(text(f"UPDATE {TABLE} SET recorded_at = UTC_TIMESTAMP() WHERE recorded_at IS NULL"))
+        conn.execute(text(
+            f"ALTER TABLE {TABLE} MODIFY recorded_at DATETIME(6) NOT NULL, "
+            "DROP PRIMARY KEY, ADD PRIMARY KEY (id, recorded_at)"
+        ))
+        oldest = conn.scalar(text(f"SELECT MIN(recorded_at) FROM {TABLE}")) or now
+        month = month_start(oldest)
+        last = add_months(month_start(now), PARTITIONS_AHEAD)
+        definitions = []
+        while month <= last:
+            definitions.append(self._definition(month))
+            month = add_months(month, 1)
+        definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+        conn.execute(text(f"ALTER TABLE {TABLE} PARTITION BY RANGE COLUMNS(recorded_at) ({', '.join(definitions)})"))
+        return True
+
+    def _definition(self, month: datetime) -> str:
+        return f"PARTITION {partition_name(month)} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')"
+
+    # Parte la partición pmax (vacía en la práctica, así que es instantáneo)
+    def ensure_future(self, conn, now: datetime = None, ahead: int = PARTITIONS_AHEAD):
+        existing = [name for name in self.list(conn) if name != MAX_PARTITION]
+        if not existing:
+            return []
+        month = add_months(partition_month(existing[-1]), 1)
+        last = add_months(month_start(now or datetime.utcnow()), ahead)
+        created = []
+        while month <= last:
+            created.append(month)
+            month = add_months(month, 1)
+        if created:
+            definitions = [self._definition(month) for month in created]
+            definitions.append(f"PARTITION {MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+            conn.execute(text(f"ALTER TABLE {TABLE} REORGANIZE PARTITION {MAX_PARTITION} INTO ({', '.join(definitions)})"))
+        return [partition_name(month) for month in created]
+
+    # DROP PARTITION libera el mes entero sin borrar fila a fila
+    def drop_expired(self, conn, cutoff: datetime):
+        expired = [
+            name for name in self.list(conn)
+            if name != MAX_PARTITION and add_months(partition_month(name), 1) <= cutoff
+        ]
+        if expired:
+            conn.execute(text(f"ALTER TABLE {TABLE} DROP PARTITION {', '.join(expired)}"))
+        return expired
+
+    # MySQL descarta por sí mismo las particiones fuera del rango de recorded_at
+    def scope(self, stmt, from_=None, to=None):
+        return stmt
+
+
+class TablePartitions:
+    def __init__(self):
+        self.months = []
+
+    def _name(self, month: datetime) -> str:
+        return f"{TABLE}_{partition_name(month)}"
+
+    def list(self, conn):
+        pattern = re.compile(rf"^{TABLE}_p\d{{6}}$")
+        names = sorted(name for name in inspect(conn).get_table_names() if pattern.match(name))
+        self.months = [partition_month(name) for name in names]
+        return names
+
+    def _create(self, conn, month: datetime):
+        name = self._name(month)
+        # Mismos microsegundos que sensor_readings (en MySQL DATETIME a secas los trunca)
+        datetime_type = "DATETIME(6)" if conn.dialect.name == "mysql" else "DATETIME"
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY, device_id INTEGER, "
+            f"temperature FLOAT, humidity FLOAT, recorded_at {datetime_type})"
+        ))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{name}_device_recorded ON {name} (device_id, recorded_at)"))
+
+    def ensure_future(self, conn, now: datetime = None, ahead: int = PARTITIONS_AHEAD):
+        existing = set(self.list(conn))
+        month = month_start(now or datetime.utcnow())
+        created = []
+        for offset in range(ahead + 1):
+            target = add_months(month, offset)
+            if self._name(target) not in existing:
+                self._create(conn, target)
+                created.append(self._name(target))
+        if created:
+            self._refresh(conn)
+        return created
+
+    # Mueve a su tabla mensual las filas de meses ya cerrados. Se deja siempre la fila
+    # de id máximo para que SQLite no reutilice ids ya movidos.
+    def rotate(self, conn, now: datetime = None):
+        current = month_start(now or datetime.utcnow())
+        max_id = conn.scalar(text(f"SELECT MAX(id) FROM {TABLE}"))
+        if max_id is None:
+            return 0
+        months = conn.execute(text(
+            f"SELECT DISTINCT strftime('%Y-%m-01', recorded_at) FROM {TABLE} "
+            "WHERE recorded_at < :current AND id < :max_id"
+        ), {"current": current, "max_id": max_id}).scalars().all()
+        moved = 0
+        for value in months:
+            month = datetime.strptime(value, "%Y-%m-%d")
+            self._create(conn, month)
+            bounds = {"start": month, "end": add_months(month, 1), "max_id": max_id}
+            where = "recorded_at >= :start AND recorded_at < :end AND id < :max_id"
+            conn.execute(text(f"INSERT INTO {self._name(month)} SELECT id, device_id, temperature, humidity, recorded_at FROM {TABLE} WHERE {where}"), bounds)
+            moved += conn.execute(text(f"DELETE FROM {TABLE} WHERE {where}"), bounds).rowcount
+        if months:
+            self._refresh(conn)
+        return moved
+
+    def drop_expired(self, conn, cutoff: datetime):
+        expired = [name for name in self.list(conn) if add_months(partition_month(name), 1) <= cutoff]
+        for name in expired:
+            conn.execute(text(f"DROP TABLE {name}"))
+        # Lecturas antiguas que aún no se han movido (p. ej. un backfill reciente)
+        conn.execute(text(f"DELETE FROM {TABLE} WHERE recorded_at < :cutoff"), {"cutoff": cutoff})
+        if expired:
+            self._refresh(conn)
+        return expired
+
+    # Vista con todos los meses, para consultas manuales
+    def _refresh(self, conn):
+        names = self.list(conn)
+        conn.execute(text(f"DROP VIEW IF EXISTS {UNION_VIEW}"))
+        selects = [f"SELECT id, device_id, temperature, humidity, recorded_at FROM {name}" for name in [TABLE] + names]
+        conn.execute(text(f"CREATE VIEW {UNION_VIEW} AS " + " UNION ALL ".join(selects)))
+
+    def _overlapping(self, from_=None, to=None):
+        from_, to = _naive(from_), _naive(to)
+        return [
+            month for month in self.months
+            if (to is None or month < to) and (from_ is None or add_months(month, 1) > from_)
+        ]
+
+    def tables(self, from_=None, to=None):
+        names = [c.name for c in SensorReading.__table__.columns]
+        return [SensorReading.__table__] + [
+            table(self._name(month), *(column(name) for name in names))
+            for month in self._overlapping(from_, to)
+        ]
+
+    # Sustituye sensor_readings por la unión de la tabla viva y los meses que se
+    # solapan con [from_, to); el resto de tablas no se lee
+    def scope(self, stmt, from_=None, to=None):
+        tables = self.tables(from_, to)
+        if len(tables) == 1:
+            return stmt
+        source = union_all(*(select(*source.c) for source in tables)).subquery(UNION_VIEW)
+        return ClauseAdapter(source).traverse(stmt)
+
+
+def _naive(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def create_partitions(mode: str):
+    if mode == "native":
+        return MySQLPartitions()
+    if mode == "tables":
+        return TablePartitions()
+    if mode == "off":
+        return None
+    raise ValueError(f"Unknown partition mode: {mode}")
+
+
+partitions = create_partitions(PARTITION_MODE)
+
+
+# Aplica la poda de particiones a una consulta sobre sensor_readings
+def partition_scope(stmt, from_=None, to=None):
+    if partitions is None:
+        return stmt
+    return partitions.scope(stmt, from_, to)
+
+
+# Tablas físicas que pueden tener lecturas de [from_, to), para borrar en cada una
+def reading_tables(from_=None, to=None):
+    if isinstance(partitions, TablePartitions):
+        return partitions.tables(from_, to)
+    return [SensorReading.__table__]
+
+
+# Conversión única a particiones nativas. Reescribe la tabla entera y bloquea las escrituras
+# mientras dura, así que no se hace al arrancar: python partitions.py convert
+def convert_table(now: datetime = None):
+    if not isinstance(partitions, MySQLPartitions):
+        raise ValueError("convert requires PARTITION_MODE=native")
+    with engine.begin() as conn:
+        return partitions.convert(conn, now or datetime.utcnow())
+
+
+# Crea los meses siguientes y aplica la retención. Cada DDL es una operación de metadatos.
+def run_maintenance(now: datetime = None):
+    if partitions is None:
+        return {}
+    now = now or datetime.utcnow()
+    result = {}
+    with engine.begin() as conn:
+        if isinstance(partitions, MySQLPartitions) and not partitions.list(conn):
+            logger.warning("PARTITION_MODE=native but %s is not partitioned yet; run: python partitions.py convert", TABLE)
+            return result
+        result["created"] = partitions.ensure_future(conn, now)
+        if isinstance(partitions, TablePartitions):
+            result["moved"] = partitions.rotate(conn, now)
+        cutoff = retention_cutoff(now)
+        result["dropped"] = partitions.drop_expired(conn, cutoff) if cutoff else []
+    return result
+
+
+# La primera pasada se hace al arrancar (run_maintenance); aquí solo las siguientes
+async def periodic_maintenance(interval: float = PARTITION_MAINTENANCE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            result = await asyncio.to_thread(run_maintenance)
+            if result.get("created") or result.get("dropped"):
+                logger.info("Partition maintenance: %s", result)
+        except Exception:
+            logger.exception("Partition maintenance failed")
+
+
+if __name__ == "__main__":
+    # python partitions.py [convert]  (con PARTITION_MODE=native o tables)
+    import sys
+    if sys.argv[1:] == ["convert"]:
+        print({"converted": convert_table()})
+    print(run_maintenance())
@@ -0,0 +1,106 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from utils import hash_password, verify_password
+
+# bcrypt cuesta ~250ms de CPU: se ejecuta en procesos aparte para no ocupar
+# el threadpool ni el GIL del worker que atiende el resto de rutas
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+HASH_MAX_CONCURRENCY = int(os.getenv("HASH_MAX_CONCURRENCY", str(HASH_WORKERS)))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "100"))
+
+
+class PasswordHasherPool:
+    def __init__(self, workers: int = HASH_WORKERS, max_concurrency: int = HASH_MAX_CONCURRENCY, max_queue: int = HASH_MAX_QUEUE):
+        self.workers = workers
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.restarts = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                # spawn: no heredar hilos ni el event loop del proceso padre
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    # Un worker muerto (OOM, kill) rompe el pool entero: se descarta y el siguiente
+    # _get_executor crea otro. Solo se descarta si nadie lo ha sustituido ya.
+    def _discard_executor(self, broken):
+        with self._executor_lock:
+            if self._executor is broken:
+                self._executor = None
+                self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    # Limita la concurrencia y rechaza con 503 si la cola ya es demasiado larga
+    async def run(self, func, *args):
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Authentication busy, retry later", headers={"Retry-After": "1"})
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        started_at = time.perf_counter()
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, func, *args)
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_wait += started_at - queued_at
+            self.total_run += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self.run(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    def stats(self):
+        completed = self.completed or 1
+        return {
+            "workers": self.workers,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": self.waiting,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+            "avg_wait_ms": round(self.total_wait / completed * 1000, 3),
+            "avg_run_ms": round(self.total_run / completed * 1000, 3),
+        }
+
+
+password_pool = PasswordHasherPool()
@@ -0,0 +1,110 @@
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+# Límites (en ms) del histograma de espera para obtener una conexión
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+            self.wait_count = 0
+            self.wait_sum_ms = 0.0
+            self.wait_max_ms = 0.0
+            self.timeouts = 0
+            self.checkouts = 0
+            self.connects = 0
+            self.invalidations = 0
+
+    def increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def observe_wait(self, elapsed_ms: float, timed_out: bool = False):
+        with self._lock:
+            index = next((i for i, bound in enumerate(WAIT_BUCKETS_MS) if elapsed_ms <= bound), len(WAIT_BUCKETS_MS))
+            self.wait_buckets[index] += 1
+            self.wait_count += 1
+            self.wait_sum_ms += elapsed_ms
+            self.wait_max_ms = max(self.wait_max_ms, elapsed_ms)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self, pool):
+        with self._lock:
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(list(WAIT_BUCKETS_MS) + ["+Inf"], self.wait_buckets):
+                cumulative += count
+                histogram[str(bound)] = cumulative
+            waits = {
+                "count": self.wait_count,
+                "sum_ms": round(self.wait_sum_ms, 3),
+                "max_ms": round(self.wait_max_ms, 3),
+                "histogram_ms": histogram,
+            }
+            counters = {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+            }
+        stats = {"pool_class": type(pool).__name__, **counters, "wait": waits}
+        # Solo QueuePool expone tamaño y overflow
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[name] = method()
+        if isinstance(pool, QueuePool):
+            stats["max_overflow"] = pool._max_overflow
+            stats["timeout"] = pool.timeout()
+        return stats
+
+
+# Métricas del engine síncrono y del asíncrono por separado
+pool_metrics = PoolMetrics()
+async_pool_metrics = PoolMetrics()
+
+
+# Mide cuánto espera cada checkout hasta obtener conexión
+class _InstrumentedPoolMixin:
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.observe_wait((time.perf_counter() - start) * 1000, timed_out=True)
+            raise
+        self.metrics.observe_wait((time.perf_counter() - start) * 1000)
+        return connection
+
+
+# Las métricas van como atributo de clase para sobrevivir a pool.recreate()
+def instrumented_pool_class(base, metrics: PoolMetrics):
+    return type(f"Instrumented{base.__name__}", (_InstrumentedPoolMixin, base), {"metrics": metrics})
+
+
+def instrument_engine(engine, metrics: PoolMetrics = pool_metrics):
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.increment("checkouts")
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        metrics.increment("connects")
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.increment("invalidations")
+
+    return engine
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# memory: eventos solo dentro del proceso
+# relay://host:port: los workers comparten eventos a través de un relay local
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "memory")
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+SSE_KEEPALIVE = float(os.getenv("REALTIME_SSE_KEEPALIVE", "15"))
+RELAY_MAX_BUFFER = 1024 * 1024
+
+
+# Cola acotada por suscriptor: si el cliente es lento se descarta la lectura
+# más antigua, así siempre recibe las más recientes
+class Subscription:
+    def __init__(self, device_id: int, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.device_id = device_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, message: str):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def get(self) -> str:
+        return await self.queue.get()
+
+
+class ReadingHub:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._loop = None
+        self.broker = None
+
+    async def start(self, broker=None):
+        self._loop = asyncio.get_running_loop()
+        self.broker = broker or create_broker(REALTIME_BROKER)
+        await self.broker.start(self.dispatch)
+
+    async def stop(self):
+        if self.broker:
+            await self.broker.stop()
+        self._loop = None
+
+    def subscribe(self, device_id: int) -> Subscription:
+        subscription = Subscription(device_id)
+        self._subscribers[device_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.device_id)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.device_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    # Reparte un evento ya serializado a los suscriptores locales del dispositivo
+    def dispatch(self, device_id: int, message: str):
+        for subscription in list(self._subscribers.get(device_id, ())):
+            subscription.offer(message)
+
+    # Se puede llamar desde cualquier hilo (rutas síncronas, flush del buffer)
+    def publish(self, rows):
+        if self._loop is None or self._loop.is_closed():
+            return
+        events = [
+            (row["device_id"], json.dumps({
+                "device_id": row["device_id"],
+                "temperature": row["temperature"],
+                "humidity": row["humidity"],
+                "recorded_at": row["recorded_at"].isoformat(),
+            }))
+            for row in rows
+        ]
+        self._loop.call_soon_threadsafe(self._publish_events, events)
+
+    def _publish_events(self, events):
+        for device_id, message in events:
+            self.dispatch(device_id, message)
+            self.broker.publish(device_id, message)
+
+
+# Broker en memoria: no hay otros procesos a los que avisar
+class MemoryBroker:
+    async def start(self, on_message):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, device_id: int, message: str):
+        pass
+
+
+# Cliente del relay local: reenvía los eventos propios y entrega los de otros workers.
+# Es un sustituto local de Redis pub/sub con la misma interfaz de broker.
+class RelayBroker:
+    def __init__(self, host: str, port: int, reconnect_delay: float = 1.0):
+        self.host = host
+        self.port = port
+        self.reconnect_delay = reconnect_delay
+        self._writer = None
+        self._task = None
+
+    async def start(self, on_message):
+        self._task = asyncio.create_task(self._run(on_message))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish(self, device_id: int, message: str):
+        if self._writer is None:
+            return
+        self._writer.write(json.dumps([device_id, message]).encode("utf-8") + b"\n")
+
+    async def _run(self, on_message):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            self._writer = writer
+            try:
+                while line := await reader.readline():
+                    device_id, message = json.loads(line)
+                    on_message(device_id, message)
+            except (OSError, ValueError):
+                logger.exception("Realtime relay connection lost")
+            finally:
+                self._writer = None
+                writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+
+def create_broker(url: str):
+    if url == "memory":
+        return MemoryBroker()
+    parsed = urlparse(url)
+    if parsed.scheme == "relay":
+        return RelayBroker(parsed.hostname or "127.0.0.1", parsed.port or 8765)
+    raise ValueError(f"Unknown realtime broker: {url}")
+
+
+# Relay: reenvía cada línea recibida a todos los demás workers conectados.
+#   python realtime.py 8765
+async def run_relay(host: str = "127.0.0.1", port: int = 8765):
+    clients = set()
+
+    async def handle(reader, writer):
+        clients.add(writer)
+        try:
+            while line := await reader.readline():
+                for client in list(clients):
+                    # Un worker que no lee no hace crecer el buffer sin límite
+                    if client is not writer and client.transport.get_write_buffer_size() < RELAY_MAX_BUFFER:
+                        client.write(line)
+        except OSError:
+            pass
+        finally:
+            clients.discard(writer)
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+hub = ReadingHub()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(run_relay(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765))
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from urllib.parse import urlparse
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fast_json import dumps
+
+# memory: LRU en el proceso; redis://host:port/db: compartido entre workers
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "memory")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "60"))
+KEY_PREFIX = "response-cache:"
+
+
+# LRU en memoria con la misma interfaz mínima que un cliente Redis (get/set/incr/delete).
+# Los contadores de versión van aparte para que el LRU nunca los expulse.
+class MemoryCacheBackend:
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        # Las versiones son locales al proceso: el ETag de un worker no vale en otro
+        self.namespace = uuid.uuid4().hex[:8]
+
+    def get(self, key: str):
+        now = time.monotonic()
+        with self._lock:
+            if key in self._counters:
+                return str(self._counters[key]).encode("ascii")
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ex: int = None):
+        expires_at = time.monotonic() + ex if ex else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._counters.pop(key, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+# Cualquier cliente compatible con Redis (redis-py o un fake con get/set/incr/delete)
+class RedisCacheBackend:
+    namespace = "shared"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str):
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ex: int = None):
+        self.client.set(key, value, ex=ex)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def delete(self, *keys: str):
+        self.client.delete(*keys)
+
+    def size(self):
+        return None
+
+
+def create_cache_backend(url: str):
+    if url == "memory":
+        return MemoryCacheBackend()
+    if urlparse(url).scheme in ("redis", "rediss"):
+        import redis
+        return RedisCacheBackend(redis.Redis.from_url(url))
+    raise ValueError(f"Unknown response cache backend: {url}")
+
+
+# Caché de respuestas JSON con ETag fuerte a partir de contadores de versión por tabla.
+# Cada escritura sobre una tabla incrementa su versión, así el ETag cambia y las
+# entradas viejas dejan de usarse sin tener que buscarlas.
+class ResponseCache:
+    def __init__(self, backend, default_ttl: int = RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def version(self, table: str) -> int:
+        value = self.backend.get(KEY_PREFIX + "version:" + table)
+        return int(value) if value is not None else 0
+
+    def invalidate(self, *tables: str):
+        for table in tables:
+            self.backend.incr(KEY_PREFIX + "version:" + table)
+
+    # scope separa las respuestas que dependen del usuario (p. ej. sus dispositivos)
+    def etag(self, route: str, tables, scope=None) -> str:
+        versions = ".".join(str(self.version(table)) for table in tables)
+        raw = f"{self.backend.namespace}|{route}|{scope}|{versions}"
+        return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest() + '"'
+
+    # Devuelve (etag, respuesta en caché o None). Con If-None-Match igual al ETag
+    # vigente la respuesta es un 304 sin cuerpo.
+    def lookup(self, request: Request, route: str, tables, scope=None):
+        etag = self.etag(route, tables, scope)
+        body = self.backend.get(KEY_PREFIX + "body:" + etag)
+        if body is None:
+            self.misses += 1
+            return etag, None
+        if etag in _parse_if_none_match(request.headers.get("if-none-match")):
+            self.not_modified += 1
+            return etag, Response(status_code=304, headers=_cache_headers(etag))
+        self.hits += 1
+        return etag, Response(content=body, media_type="application/json", headers=_cache_headers(etag))
+
+    def store(self, etag: str, payload, ttl: int = None) -> Response:
+        body = dumps(jsonable_encoder(payload))
+        self.backend.set(KEY_PREFIX + "body:" + etag, body, ex=ttl or self.default_ttl)
+        return Response(content=body, media_type="application/json", headers=_cache_headers(etag))
+
+    def stats(self):
+        total = self.hits + self.misses + self.not_modified
+        return {
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.not_modified) / total, 4) if total else None,
+            "size": self.backend.size(),
+            "backend": type(self.backend).__name__,
+        }
+
+
+def _parse_if_none_match(header: str):
+    if not header:
+        return set()
+    # Comparación débil (RFC 9110): el middleware de compresión marca el ETag como W/
+    return {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+# Respuestas por usuario: solo caché privada y siempre revalidando con el ETag
+def _cache_headers(etag: str):
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+
+response_cache = ResponseCache(create_cache_backend(RESPONSE_CACHE_URL))
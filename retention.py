@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import ReadingChunk, SensorReading, SensorRollup
+from partitions import partition_scope
+from rollups import RESOLUTIONS, covered_by_rollups, upsert_rollups
+from archive import chunk_rows, delete_raw_hour, raw_hours
+
+logger = logging.getLogger(__name__)
+
+# Días que se conserva cada nivel; 0 lo conserva siempre. Los resúmenes diarios no caducan.
+#   lecturas crudas -> resúmenes por minuto -> por hora -> por día
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "0"))
+ROLLUP_1M_RETENTION_DAYS = int(os.getenv("ROLLUP_1M_RETENTION_DAYS", "0"))
+ROLLUP_1H_RETENTION_DAYS = int(os.getenv("ROLLUP_1H_RETENTION_DAYS", "0"))
+# Cada hora de un dispositivo se compacta en su propia transacción; esto limita
+# cuántas se procesan por pasada para repartir el trabajo
+COMPACTION_MAX_HOURS = int(os.getenv("COMPACTION_MAX_HOURS", "500"))
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "300"))
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+TIER_RETENTION = {"raw": RAW_RETENTION_DAYS, "1m": ROLLUP_1M_RETENTION_DAYS, "1h": ROLLUP_1H_RETENTION_DAYS, "1d": 0}
+
+
+def retention_enabled() -> bool:
+    return any(TIER_RETENTION.values())
+
+
+# Desde cuándo hay datos de un nivel (None: desde siempre). Alineado al día para que
+# todos los buckets encajen en los cortes.
+def _utc_naive(value):
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def tier_cutoff(tier: str, now: datetime = None):
+    days = TIER_RETENTION[tier]
+    if days <= 0:
+        return None
+    today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days)
+
+
+def _raw_range(stmt, device_id: int, start: datetime, end: datetime):
+    stmt = stmt.where(
+        SensorReading.device_id == device_id,
+        SensorReading.recorded_at >= start,
+        SensorReading.recorded_at < end,
+    )
+    return partition_scope(stmt, start, end)
+
+
+# Recalcula el resumen diario a partir de los horarios del mismo día
+def _rebuild_day(db: Session, device_id: int, day: datetime):
+    hourly = (SensorRollup.device_id == device_id) & (SensorRollup.resolution == "1h") & \
+        (SensorRollup.bucket_start >= day) & (SensorRollup.bucket_start < day + DAY)
+    total = db.execute(select(
+        func.sum(SensorRollup.count), func.sum(SensorRollup.temp_sum),
+        func.min(SensorRollup.temp_min), func.max(SensorRollup.temp_max),
+        func.sum(SensorRollup.hum_sum), func.min(SensorRollup.hum_min), func.max(SensorRollup.hum_max),
+    ).where(hourly)).one()
+    db.execute(delete(SensorRollup).where(
+        SensorRollup.device_id == device_id, SensorRollup.resolution == "1d", SensorRollup.bucket_start == day,
+    ))
+    if total[0]:
+        db.add(SensorRollup(
+            device_id=device_id, resolution="1d", bucket_start=day, count=total[0],
+            temp_sum=total[1], temp_min=total[2], temp_max=total[3],
+            hum_sum=total[4], hum_min=total[5], hum_max=total[6],
+        ))
+
+
+# Compacta una hora de un dispositivo: deja los resúmenes 1m/1h exactos y borra las
+# lecturas crudas y el chunk archivado. Si el resumen horario ya cuenta todas las filas
+# (modo inline) solo se borra; si cuenta menos (datos anteriores a los rollups, modo off
+# o periodic con retraso) se reconstruye desde las filas.
+def compact_hour(db: Session, device_id: int, hour: datetime) -> int:
+    end = hour + HOUR
+    raw_count, max_id = db.execute(_raw_range(
+        select(func.count(SensorReading.id), func.max(SensorReading.id)), device_id, hour, end,
+    )).one()
+    archived = db.scalar(select(ReadingChunk.count).where(
+        ReadingChunk.device_id == device_id, ReadingChunk.hour_start == hour,
+    )) or 0
+    if not raw_count and not archived:
+        return 0
+    # En modo periodic se espera a que el job haya pasado por estas filas
+    if raw_count and not covered_by_rollups(db, max_id):
+        return 0
+
+    rolled = db.scalar(select(SensorRollup.count).where(
+        SensorRollup.device_id == device_id, SensorRollup.resolution == "1h", SensorRollup.bucket_start == hour,
+    )) or 0
+    if rolled < raw_count + archived:
+        rows = db.execute(_raw_range(
+            select(SensorReading.device_id, SensorReading.temperature, SensorReading.humidity, SensorReading.recorded_at),
+            device_id, hour, end,
+        )).mappings().all()
+        rows = list(rows) + [
+            {"device_id": device_id, "temperature": temperature, "humidity": humidity, "recorded_at": recorded_at}
+            for _, recorded_at, temperature, humidity in chunk_rows(db, device_id, hour)
+        ]
+        db.execute(delete(SensorRollup).where(
+            SensorRollup.device_id == device_id, SensorRollup.resolution.in_(("1m", "1h")),
+            SensorRollup.bucket_start >= hour, SensorRollup.bucket_start < end,
+        ))
+        upsert_rollups(db, rows, resolutions=("1m", "1h"))
+        _rebuild_day(db, device_id, hour.replace(hour=0))
+
+    delete_raw_hour(db, device_id, hour)
+    db.execute(delete(ReadingChunk).where(ReadingChunk.device_id == device_id, ReadingChunk.hour_start == hour))
+    db.commit()
+    return raw_count + archived
+
+
+# Recorre las horas con lecturas crudas anteriores al corte y después las archivadas
+def compact_raw(db: Session, cutoff: datetime, max_hours: int = COMPACTION_MAX_HOURS):
+    hours = rows = 0
+    for device_id, hour in raw_hours(db, cutoff):
+        if hours >= max_hours:
+            break
+        rows += compact_hour(db, device_id, hour)
+        hours += 1
+    if hours < max_hours:
+        chunks = db.execute(
+            select(ReadingChunk.device_id, ReadingChunk.hour_start).where(ReadingChunk.hour_start < cutoff)
+            .order_by(ReadingChunk.hour_start).limit(max_hours - hours)
+        ).all()
+        for device_id, hour in chunks:
+            rows += compact_hour(db, device_id, hour)
+            hours += 1
+    return {"hours": hours, "rows": rows}
+
+
+# Borra un nivel de resúmenes caducado, un día cada vez
+def purge_rollups(db: Session, resolution: str, cutoff: datetime, max_days: int = 31) -> int:
+    deleted = 0
+    for _ in range(max_days):
+        oldest = db.scalar(select(func.min(SensorRollup.bucket_start)).where(
+            SensorRollup.resolution == resolution, SensorRollup.bucket_start < cutoff,
+        ))
+        if oldest is None:
+            break
+        day_end = min(oldest.replace(hour=0, minute=0, second=0, microsecond=0) + DAY, cutoff)
+        deleted += db.execute(delete(SensorRollup).where(
+            SensorRollup.resolution == resolution, SensorRollup.bucket_start < day_end,
+        )).rowcount
+        db.commit()
+    return deleted
+
+
+def run_retention(now: datetime = None):
+    db = SessionLocal()
+    try:
+        result = {}
+        raw_cutoff = tier_cutoff("raw", now)
+        if raw_cutoff is not None:
+            result["raw"] = compact_raw(db, raw_cutoff)
+        for resolution in ("1m", "1h"):
+            cutoff = tier_cutoff(resolution, now)
+            if cutoff is not None:
+                result[resolution] = purge_rollups(db, resolution, cutoff)
+        return result
+    finally:
+        db.close()
+
+
+async def periodic_retention(interval: float = RETENTION_INTERVAL):
+    while True:
+        try:
+            result = await asyncio.to_thread(run_retention)
+            if result.get("raw", {}).get("rows") or result.get("1m") or result.get("1h"):
+                logger.info("Retention: %s", result)
+        except Exception:
+            logger.exception("Retention run failed")
+        await asyncio.sleep(interval)
+
+
+# Niveles que tienen datos en [from_, to): lista de (desde, hasta, nivel) del más antiguo
+# al más reciente, cada tramo servido por el nivel más fino que aún existe
+def tier_segments(from_: datetime, to: datetime, now: datetime = None):
+    # Los cortes son UTC sin zona; comparar con un from/to con zona lanzaría TypeError
+    from_, to, now = _utc_naive(from_), _utc_naive(to), _utc_naive(now)
+    boundaries = []
+    for tier in ("1h", "1m", "raw"):
+        cutoff = tier_cutoff(tier, now)
+        if cutoff is not None and from_ < cutoff < to:
+            boundaries.append(cutoff)
+    edges = [from_] + sorted(set(boundaries)) + [to]
+    segments = []
+    for start, end in zip(edges, edges[1:]):
+        available = [
+            tier for tier in ("raw", "1m", "1h", "1d")
+            if tier_cutoff(tier, now) is None or tier_cutoff(tier, now) <= start
+        ]
+        segments.append((start, end, available))
+    return segments
+
+
+# Nivel de resumen para un bucket entre los disponibles: el más grueso que lo divide
+# o, si ya no queda ninguno, el más fino que sigue existiendo
+def rollup_for_bucket(seconds: int, available):
+    rollups = [tier for tier in available if tier in RESOLUTIONS]
+    dividing = [tier for tier in rollups if seconds % RESOLUTIONS[tier] == 0]
+    if dividing:
+        return max(dividing, key=RESOLUTIONS.get)
+    return min(rollups, key=RESOLUTIONS.get)
+
+
+if __name__ == "__main__":
+    print(run_retention())
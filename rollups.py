@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import SensorReading, SensorRollup, RollupState
+
+logger = logging.getLogger(__name__)
+
+# inline: los rollups se actualizan en la misma transacción que el INSERT
+# periodic: un job en segundo plano los pone al día desde la marca de agua
+# off: no se mantienen y los agregados se calculan sobre sensor_readings
+ROLLUP_MODE = os.getenv("ROLLUP_MODE", "inline").lower()
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "10000"))
+STATE_NAME = "sensor_readings"
+
+# Resoluciones disponibles, en segundos
+RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+
+def truncate(recorded_at: datetime, resolution: str) -> datetime:
+    if resolution == "1m":
+        return recorded_at.replace(second=0, microsecond=0)
+    if resolution == "1h":
+        return recorded_at.replace(minute=0, second=0, microsecond=0)
+    return recorded_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# Rollup más grueso cuyo tamaño divide exactamente al bucket pedido
+def rollup_resolution_for(seconds: int):
+    if ROLLUP_MODE == "off":
+        return None
+    candidates = [name for name, size in RESOLUTIONS.items() if seconds % size == 0]
+    return max(candidates, key=RESOLUTIONS.get) if candidates else None
+
+
+# Agrupa las lecturas en memoria para hacer un único upsert por bucket.
+# Primero por minuto (una truncación por fila) y luego se pliegan los minutos en horas y días.
+def summarize(rows):
+    minutes = {}
+    for row in rows:
+        temperature = row["temperature"]
+        humidity = row["humidity"]
+        key = (row["device_id"], row["recorded_at"].replace(second=0, microsecond=0))
+        b = minutes.get(key)
+        if b is None:
+            minutes[key] = [1, temperature, temperature, temperature, humidity, humidity, humidity]
+            continue
+        b[0] += 1
+        b[1] += temperature
+        if temperature < b[2]:
+            b[2] = temperature
+        if temperature > b[3]:
+            b[3] = temperature
+        b[4] += humidity
+        if humidity < b[5]:
+            b[5] = humidity
+        if humidity > b[6]:
+            b[6] = humidity
+
+    buckets = {}
+    for (device_id, minute), (count, t_sum, t_min, t_max, h_sum, h_min, h_max) in minutes.items():
+        for resolution in RESOLUTIONS:
+            bucket_start = minute if resolution == "1m" else truncate(minute, resolution)
+            key = (device_id, resolution, bucket_start)
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = {
+                    "device_id": device_id, "resolution": resolution, "bucket_start": bucket_start, "count": count,
+                    "temp_sum": t_sum, "temp_min": t_min, "temp_max": t_max,
+                    "hum_sum": h_sum, "hum_min": h_min, "hum_max": h_max,
+                }
+                continue
+            b["count"] += count
+            b["temp_sum"] += t_sum
+            b["temp_min"] = min(b["temp_min"], t_min)
+            b["temp_max"] = max(b["temp_max"], t_max)
+            b["hum_sum"] += h_sum
+            b["hum_min"] = min(b["hum_min"], h_min)
+            b["hum_max"] = max(b["hum_max"], h_max)
+    return list(buckets.values())
+
+
+def _upsert_statement(dialect: str, values):
+    table = SensorRollup.__table__
+    if dialect == "mysql":
+        stmt = mysql.insert(table).values(values)
+        new = stmt.inserted
+        return stmt.on_duplicate_key_update(
+            count=table.c.count + new.count,
+            temp_sum=table.c.temp_sum + new.temp_sum,
+            temp_min=func.least(table.c.temp_min, new.temp_min),
+            temp_max=func.greatest(table.c.temp_max, new.temp_max),
+            hum_sum=table.c.hum_sum + new.hum_sum,
+            hum_min=func.least(table.c.hum_min, new.hum_min),
+            hum_max=func.greatest(table.c.hum_max, new.hum_max),
+        )
+    if dialect in ("sqlite", "postgresql"):
+        module = sqlite if dialect == "sqlite" else postgresql
+        # En SQLite min()/max() con dos argumentos son escalares
+        least, greatest = (func.min, func.max) if dialect == "sqlite" else (func.least, func.greatest)
+        stmt = module.insert(table).values(values)
+        new = stmt.excluded
+        return stmt.on_conflict_do_update(
+            index_elements=[table.c.device_id, table.c.resolution, table.c.bucket_start],
+            set_={
+                "count": table.c.count + new.count,
+                "temp_sum": table.c.temp_sum + new.temp_sum,
+                "temp_min": least(table.c.temp_min, new.temp_min),
+                "temp_max": greatest(table.c.temp_max, new.temp_max),
+                "hum_sum": table.c.hum_sum + new.hum_sum,
+                "hum_min": least(table.c.hum_min, new.hum_min),
+                "hum_max": greatest(table.c.hum_max, new.hum_max),
+            },
+        )
+    raise NotImplementedError(f"Rollups are not supported on {dialect}")
+
+
+def upsert_rollups(db: Session, rows, chunk_size: int = 1000, resolutions=RESOLUTIONS):
+    values = [value for value in summarize(rows) if value["resolution"] in resolutions]
+    dialect = db.get_bind().dialect.name
+    for start in range(0, len(values), chunk_size):
+        db.execute(_upsert_statement(dialect, values[start:start + chunk_size]))
+
+
+# Hook de ingesta: se llama antes del commit con las filas insertadas
+def apply_rollups(db: Session, rows):
+    if ROLLUP_MODE == "inline" and rows:
+        upsert_rollups(db, rows)
+
+
+# En modo periodic las filas con id por encima de la marca de agua aún no están en
+# los rollups; no se pueden borrar ni archivar todavía
+def covered_by_rollups(db: Session, max_id: int) -> bool:
+    if ROLLUP_MODE != "periodic":
+        return True
+    state = db.get(RollupState, STATE_NAME)
+    return state is not None and max_id <= state.last_id
+
+
+def _locked_state(db: Session) -> RollupState:
+    state = db.execute(
+        select(RollupState).where(RollupState.name == STATE_NAME).with_for_update()
+    ).scalar_one_or_none()
+    if state is None:
+        state = RollupState(name=STATE_NAME, last_id=0, pending_id=0)
+        db.add(state)
+        db.flush()
+    return state
+
+
+# Procesa las lecturas entre last_id y pending_id, con un commit por lote.
+# Dejar una vuelta de margen evita saltarse filas de transacciones que
+# todavía no habían hecho commit cuando se leyó el máximo id.
+def catch_up(db: Session, batch_size: int = ROLLUP_BATCH_SIZE) -> int:
+    processed = 0
+    while True:
+        state = _locked_state(db)
+        if state.last_id >= state.pending_id:
+            break
+        rows = db.execute(
+            select(SensorReading.id, SensorReading.device_id, SensorReading.temperature,
+                   SensorReading.humidity, SensorReading.recorded_at)
+            .where(SensorReading.id > state.last_id, SensorReading.id <= state.pending_id)
+            .order_by(SensorReading.id)
+            .limit(batch_size)
+        ).mappings().all()
+        if rows:
+            upsert_rollups(db, rows)
+            state.last_id = rows[-1]["id"]
+            processed += len(rows)
+        else:
+            state.last_id = state.pending_id
+        db.commit()
+
+    state.pending_id = db.scalar(select(func.max(SensorReading.id))) or 0
+    db.commit()
+    return processed
+
+
+def run_catch_up() -> int:
+    db = SessionLocal()
+    try:
+        return catch_up(db)
+    finally:
+        db.close()
+
+
+async def periodic_catch_up(interval: float = ROLLUP_INTERVAL):
+    while True:
+        try:
+            processed = await asyncio.to_thread(run_catch_up)
+            if processed:
+                logger.info("Rolled up %d sensor readings", processed)
+        except Exception:
+            logger.exception("Rollup catch-up failed")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    # Dos pasadas: la primera fija pending_id, la segunda procesa hasta ahí
+    print(f"Rolled up {run_catch_up() + run_catch_up()} readings")
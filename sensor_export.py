@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+from itertools import islice
+from sqlalchemy import select
+from database import SessionLocal
+from models import SensorReading
+from sensor_queries import apply_sensor_filters, utc_naive
+from partitions import partition_scope
+from archive import iter_archived
+
+# Filas que se piden al cursor del servidor en cada vuelta
+EXPORT_BATCH_SIZE = 5000
+
+EXPORT_COLUMNS = ("id", "device_id", "temperature", "humidity", "recorded_at")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _ndjson_chunk(rows):
+    return "".join(
+        json.dumps({
+            "id": row.id,
+            "device_id": row.device_id,
+            "temperature": row.temperature,
+            "humidity": row.humidity,
+            "recorded_at": row.recorded_at.isoformat() if row.recorded_at else None,
+        }) + "\n"
+        for row in rows
+    )
+
+
+def _csv_chunk(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(
+        (row.id, row.device_id, row.temperature, row.humidity,
+         row.recorded_at.isoformat() if row.recorded_at else "")
+        for row in rows
+    )
+    return buffer.getvalue()
+
+
+def _batches(rows, size: int):
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# Generador para StreamingResponse: abre su propia sesión porque la de
+# Depends(get_db) se cierra antes de que termine de enviarse la respuesta
+def iter_sensor_export(export_format: str, device_id=None, from_=None, to=None, owner_id=None, batch_size: int = EXPORT_BATCH_SIZE):
+    # Mismo rango en UTC para las horas archivadas, las particiones y la tabla viva
+    from_, to = utc_naive(from_), utc_naive(to)
+    db = SessionLocal()
+    try:
+        stmt = apply_sensor_filters(
+            select(*(getattr(SensorReading, column) for column in EXPORT_COLUMNS)),
+            device_id, from_, to, owner_id,
+        )
+        # Con device_id el índice (device_id, recorded_at) ya da el orden; sin él se
+        # recorre por clave primaria para no ordenar toda la tabla antes del primer byte
+        if device_id is not None:
+            stmt = stmt.order_by(SensorReading.recorded_at, SensorReading.id)
+        else:
+            stmt = stmt.order_by(SensorReading.id)
+        stmt = partition_scope(stmt, from_, to)
+        render = _csv_chunk if export_format == "csv" else _ndjson_chunk
+        if export_format == "csv":
+            yield _csv_chunk([], header=True)
+
+        # Primero las horas archivadas: el cursor del servidor de abajo no admite otra
+        # consulta abierta en la misma conexión mientras se recorre
+        for rows in _batches(iter_archived(db, device_id, from_, to, owner_id), batch_size):
+            yield render(rows)
+
+        # stream_results usa un cursor del lado del servidor (SSCursor en MySQL)
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=batch_size))
+        for rows in result.partitions():
+            yield render(rows)
+    finally:
+        db.close()
@@ -0,0 +1,124 @@
+import struct
+from array import array
+from datetime import datetime, timedelta
+from fastapi.responses import Response
+from fast_json import dumps, rows_to_dicts
+
+# pyarrow es opcional: sin él no se ofrece Arrow IPC
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Formatos de /sensores según Accept. Las filas llegan como tuplas
+# (id, device_id, temperature, humidity, recorded_at).
+PAGE_FIELDS = ("id", "device_id", "temperature", "humidity", "recorded_at")
+ROWS_JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.sensor.columnar+json"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PACKED = "application/vnd.sensor.packed"
+
+# Binario empaquetado, little-endian:
+#   cabecera "SNS1" + uint32 n
+#   int64 id[n], int64 device_id[n], int64 ts_ms[n], float32 temperature[n], float32 humidity[n]
+PACKED_MAGIC = b"SNS1"
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def available_formats():
+    formats = [ROWS_JSON, COLUMNAR_JSON, PACKED]
+    if pa is not None:
+        formats.append(ARROW_STREAM)
+    return formats
+
+
+# Elige el formato de mayor q en Accept; sin coincidencia se responde JSON por filas
+def negotiate(accept: str) -> str:
+    if not accept:
+        return ROWS_JSON
+    supported = available_formats()
+    candidates = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, _, params = part.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.strip().lower()
+        if quality > 0 and media_type in supported:
+            candidates.append((-quality, position, media_type))
+    return min(candidates)[2] if candidates else ROWS_JSON
+
+
+# Transpone las tuplas de la base de datos en columnas
+def to_columns(rows):
+    if not rows:
+        return [], [], [], [], []
+    return [list(column) for column in zip(*rows)]
+
+
+def _epoch_ms(timestamps):
+    return [(ts - EPOCH) // MILLISECOND for ts in timestamps]
+
+
+def columnar_json(rows, next_cursor=None) -> bytes:
+    ids, device_ids, temperatures, humidities, recorded_at = to_columns(rows)
+    return dumps({
+        "id": ids,
+        "device_id": device_ids,
+        "ts": _epoch_ms(recorded_at),
+        "temperature": temperatures,
+        "humidity": humidities,
+        "next_cursor": next_cursor,
+    })
+
+
+def packed(rows) -> bytes:
+    ids, device_ids, temperatures, humidities, recorded_at = to_columns(rows)
+    parts = [
+        PACKED_MAGIC + struct.pack("<I", len(ids)),
+        array("q", ids),
+        array("q", device_ids),
+        array("q", _epoch_ms(recorded_at)),
+        array("f", temperatures),
+        array("f", humidities),
+    ]
+    # array usa el orden de bytes de la máquina
+    if struct.pack("=I", 1) != struct.pack("<I", 1):
+        for part in parts[1:]:
+            part.byteswap()
+    return b"".join(part if isinstance(part, bytes) else part.tobytes() for part in parts)
+
+
+def arrow_ipc(rows) -> bytes:
+    ids, device_ids, temperatures, humidities, recorded_at = to_columns(rows)
+    table = pa.table({
+        "id": pa.array(ids, pa.int64()),
+        "device_id": pa.array(device_ids, pa.int64()),
+        "recorded_at": pa.array(recorded_at, pa.timestamp("us")),
+        "temperature": pa.array(temperatures, pa.float64()),
+        "humidity": pa.array(humidities, pa.float64()),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# Página de /sensores en el formato negociado; en los binarios el cursor va en X-Next-Cursor
+def page_response(media_type: str, rows, next_cursor=None) -> Response:
+    headers = {"Vary": "Accept"}
+    if media_type == COLUMNAR_JSON:
+        body = columnar_json(rows, next_cursor)
+    elif media_type in (PACKED, ARROW_STREAM):
+        body = packed(rows) if media_type == PACKED else arrow_ipc(rows)
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+    else:
+        body = dumps({"items": rows_to_dicts(PAGE_FIELDS, rows), "next_cursor": next_cursor})
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,215 @@
+import csv
+import os
+from datetime import datetime, timezone
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import Device, SensorReading
+from jobs import JobProcessor, register_processor
+from excel_import import iter_sheet_rows
+from rollups import apply_rollups
+from idempotency import EXPIRED_ERROR, dedup_horizon, insert_each, split_duplicates
+from latest_cache import latest_readings
+
+# pyarrow es opcional: acelera CSV y es necesario para Parquet
+try:
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa_csv = None
+    pa_parquet = None
+
+SENSOR_IMPORT_CHUNK_SIZE = int(os.getenv("SENSOR_IMPORT_CHUNK_SIZE", "10000"))
+ARROW_BATCH_SIZE = 64 * 1024
+COLUMNS = ("device_id", "temperature", "humidity", "recorded_at")
+FORMATS = {".csv": "csv", ".xlsx": "xlsx", ".parquet": "parquet"}
+
+
+def detect_format(filename: str, requested: str = None) -> str:
+    if requested:
+        fmt = requested.lower()
+    else:
+        fmt = FORMATS.get(os.path.splitext(filename or "")[1].lower())
+    if fmt not in FORMATS.values():
+        raise ValueError("Unsupported file format. Use csv, xlsx or parquet")
+    if fmt == "parquet" and pa_parquet is None:
+        raise ValueError("Parquet import requires pyarrow")
+    return fmt
+
+
+def _column_positions(header):
+    names = [str(name).strip().lower() if name is not None else "" for name in header]
+    missing = [column for column in COLUMNS if column not in names]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return [names.index(column) for column in COLUMNS]
+
+
+# Convierte lotes columnares de Arrow en filas sin pasar por pandas
+def _iter_arrow_batches(batches, first_row: int):
+    number = first_row
+    for batch in batches:
+        columns = [batch.column(name).to_pylist() for name in COLUMNS]
+        for row in zip(*columns):
+            yield number, row
+            number += 1
+
+
+def _arrow_columns(schema_names):
+    lowered = {name.lower(): name for name in schema_names}
+    missing = [column for column in COLUMNS if column not in lowered]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    return [lowered[column] for column in COLUMNS]
+
+
+def _iter_csv(path: str):
+    if pa_csv is not None:
+        # Todas las columnas como texto: los tipos inferidos del primer bloque harían fallar el
+        # trabajo entero con un valor no numérico más adelante; así cada fila mala se rechaza
+        # en process_reading_chunk, igual que con el lector csv
+        with open(path, newline="", encoding="utf-8-sig") as handle:
+            header = next(csv.reader(handle), [])
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(block_size=ARROW_BATCH_SIZE * 64),
+            convert_options=pa_csv.ConvertOptions(column_types={name: "string" for name in header}),
+        )
+        names = _arrow_columns(reader.schema.names)
+        batches = (batch.select(names).rename_columns(list(COLUMNS)) for batch in reader)
+        yield from _iter_arrow_batches(batches, first_row=2)
+        return
+
+    with open(path, newline="", encoding="utf-8-sig") as handle:
+        reader = csv.reader(handle)
+        positions = _column_positions(next(reader, []))
+        for number, row in enumerate(reader, start=2):
+            if row:
+                yield number, tuple(row[i] if i < len(row) else None for i in positions)
+
+
+def _iter_xlsx(path: str):
+    rows = iter_sheet_rows(path, min_row=1)
+    first = next(rows, None)
+    if first is None:
+        return
+    positions = _column_positions(first[1])
+    for number, row in rows:
+        yield number, tuple(row[i] if i < len(row) else None for i in positions)
+
+
+def _iter_parquet(path: str):
+    parquet = pa_parquet.ParquetFile(path)
+    names = _arrow_columns(parquet.schema_arrow.names)
+    batches = (
+        batch.rename_columns(list(COLUMNS))
+        for batch in parquet.iter_batches(batch_size=ARROW_BATCH_SIZE, columns=names)
+    )
+    yield from _iter_arrow_batches(batches, first_row=1)
+
+
+def iter_reading_file(path: str, options):
+    fmt = options.get("format", "csv")
+    if fmt == "parquet":
+        return _iter_parquet(path)
+    if fmt == "xlsx":
+        return _iter_xlsx(path)
+    return _iter_csv(path)
+
+
+def _parse_timestamp(value):
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, str) and value.strip():
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    else:
+        raise ValueError("missing recorded_at")
+    # Se guarda en UTC sin zona horaria, como recorded_at del resto de la API
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+# Resultado de validación por dispositivo: una consulta por lote para todos sus dispositivos,
+# no una por fila. Es local a cada lote; las opciones del trabajo se guardan en la base de datos.
+def _check_devices(db: Session, device_ids, owner):
+    found = dict(db.execute(select(Device.id, Device.user_id).where(Device.id.in_(device_ids))).all()) if device_ids else {}
+    known = {}
+    for device_id in device_ids:
+        if device_id not in found:
+            known[device_id] = "Device not found"
+        elif owner is not None and found[device_id] != owner:
+            known[device_id] = "Device does not belong to the uploading user"
+        else:
+            known[device_id] = None
+    return known
+
+
+# Inserta con executemany del driver: PyMySQL lo reescribe como un INSERT multi-row. Va en
+# un savepoint; si otro proceso guardó alguna fila entre la comprobación y el INSERT se
+# repite fila a fila. Devuelve las filas insertadas.
+def copy_readings(db: Session, rows):
+    connection = db.connection()
+    mark = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+    # Mismo formato de recorded_at que el resto de inserciones (en SQLite es texto y sin
+    # esto la clave natural no casaría con las filas escritas por SQLAlchemy)
+    to_db = SensorReading.__table__.c.recorded_at.type.dialect_impl(connection.dialect).bind_processor(connection.dialect)
+    params = [
+        (row["device_id"], row["temperature"], row["humidity"], to_db(row["recorded_at"]) if to_db else row["recorded_at"])
+        for row in rows
+    ]
+    try:
+        with db.begin_nested():
+            connection.exec_driver_sql(
+                "INSERT INTO sensor_readings (device_id, temperature, humidity, recorded_at) "
+                f"VALUES ({mark}, {mark}, {mark}, {mark})",
+                params,
+            )
+        return rows
+    except IntegrityError:
+        return insert_each(db, rows)
+
+
+def process_reading_chunk(db: Session, chunk, options):
+    errors = []
+    parsed = []
+    horizon = dedup_horizon()
+    for number, (device_id, temperature, humidity, recorded_at) in chunk:
+        try:
+            row = (int(device_id), float(temperature), float(humidity), _parse_timestamp(recorded_at))
+        except (TypeError, ValueError) as e:
+            errors.append((number, f"Invalid row: {e}"))
+            continue
+        if horizon is not None and row[3] < horizon:
+            errors.append((number, EXPIRED_ERROR))
+        else:
+            parsed.append((number, row))
+
+    device_errors = _check_devices(db, {row[0] for _, row in parsed}, options.get("user_id"))
+    rows = []
+    for number, row in parsed:
+        error = device_errors[row[0]]
+        if error:
+            errors.append((number, error))
+        else:
+            rows.append(row)
+    if not rows:
+        return 0, errors, []
+
+    # Un lote reanudado o un archivo subido dos veces no duplica lecturas ni rollups:
+    # las repetidas cuentan como hechas pero solo se insertan las nuevas
+    dict_rows = [
+        {"device_id": d, "temperature": t, "humidity": h, "recorded_at": r}
+        for d, t, h, r in rows
+    ]
+    new, _ = split_duplicates(db, dict_rows)
+    if new:
+        new = copy_readings(db, new)
+        apply_rollups(db, new)
+    return len(rows), errors, new
+
+
+register_processor("sensor_readings", JobProcessor(
+    iter_reading_file, process_reading_chunk,
+    chunk_size=SENSOR_IMPORT_CHUNK_SIZE, after_commit=latest_readings.update,
+))
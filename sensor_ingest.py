@@ -0,0 +1,205 @@
+import json
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from models import Device, SensorReading, SensorDataIn
+from rollups import apply_rollups
+from idempotency import EXPIRED_ERROR, dedup_horizon, insert_each, reading_key, remember_readings, split_duplicates
+from latest_cache import latest_readings
+from realtime import hub
+
+logger = logging.getLogger(__name__)
+
+# Filas por INSERT multi-row; MySQL corta en max_allowed_packet si es demasiado grande
+BATCH_CHUNK_SIZE = 1000
+MAX_BATCH_ITEMS = 50000
+
+
+# Convierte el cuerpo (array JSON o NDJSON) en una lista de objetos sin validar
+def parse_batch_body(body: bytes, content_type: str = ""):
+    try:
+        text = body.decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body is not valid UTF-8")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                # Una línea corrupta se rechaza sola, no todo el lote
+                items.append(e)
+        return items
+
+    try:
+        items = json.loads(text)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of readings")
+    return items
+
+
+# Valida cada elemento y separa los aceptados de los rechazados
+def validate_batch(items, db: Session):
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_ITEMS} items)")
+
+    results = []
+    valid = []
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            results.append({"index": index, "status": "rejected", "error": f"Invalid JSON: {item}"})
+            continue
+        try:
+            reading = SensorDataIn.model_validate(item)
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results.append({"index": index, "status": "rejected", "error": errors})
+            continue
+        results.append({"index": index, "status": "accepted"})
+        valid.append((index, reading))
+
+    # Un solo SELECT para comprobar todos los dispositivos del lote
+    device_ids = {reading.device_id for _, reading in valid}
+    known = set()
+    if device_ids:
+        known = set(db.scalars(select(Device.id).where(Device.id.in_(device_ids))))
+
+    rows = []
+    positions = []
+    now = datetime.utcnow()
+    horizon = dedup_horizon(now)
+    # Sin recorded_at todas las filas del lote llevan la hora del servidor; las de un mismo
+    # dispositivo se separan un microsegundo para que la clave natural no las tome por repetidas
+    stamped = Counter()
+    for index, reading in valid:
+        if reading.device_id not in known:
+            results[index] = {"index": index, "status": "rejected", "error": "Device not found"}
+            continue
+        row = reading_row(reading, now + timedelta(microseconds=stamped[reading.device_id]))
+        if reading.recorded_at is None:
+            stamped[reading.device_id] += 1
+        elif horizon is not None and row["recorded_at"] < horizon:
+            results[index] = {"index": index, "status": "rejected", "error": EXPIRED_ERROR}
+            continue
+        rows.append(row)
+        positions.append(index)
+    return rows, results, positions
+
+
+def reading_row(reading: SensorDataIn, now: datetime):
+    recorded_at = reading.recorded_at or now
+    # Se guarda en UTC sin zona horaria, como recorded_at del resto de la API
+    if recorded_at.tzinfo is not None:
+        recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return {
+        "device_id": reading.device_id,
+        "temperature": reading.temperature,
+        "humidity": reading.humidity,
+        "recorded_at": recorded_at,
+    }
+
+
+# Inserta las filas en bloques con INSERT multi-row, todo en una transacción, saltando las
+# que ya existen por (device_id, recorded_at). Cada fila debe traer recorded_at para que
+# los rollups usen el mismo valor; solo las filas insertadas pasan a los rollups.
+# Devuelve (filas insertadas, {posición: id existente o None} de las repetidas).
+def bulk_insert_readings(rows, db: Session, chunk_size: int = BATCH_CHUNK_SIZE):
+    new, duplicates = split_duplicates(db, rows)
+    inserted = insert_new_readings(db, new, chunk_size)
+    if len(inserted) < len(new):
+        # Las que insertó otro reintento entre la comprobación y el INSERT
+        positions = {reading_key(row): position for position, row in enumerate(rows)}
+        saved = {reading_key(row) for row in inserted}
+        for row in new:
+            if reading_key(row) not in saved:
+                duplicates[positions[reading_key(row)]] = None
+    apply_rollups(db, inserted)
+    return inserted, duplicates
+
+
+# Cada bloque va en un savepoint: si choca con el índice único se repite fila a fila. Así se
+# sabe qué filas entraron sin fiarse del rowcount (MySQL con CLIENT_FOUND_ROWS cuenta
+# también las encontradas en ON DUPLICATE KEY).
+def insert_new_readings(db: Session, rows, chunk_size: int = BATCH_CHUNK_SIZE):
+    inserted = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            with db.begin_nested():
+                db.execute(insert(SensorReading.__table__), chunk)
+            inserted.extend(chunk)
+        except IntegrityError:
+            inserted.extend(insert_each(db, chunk))
+    return inserted
+
+
+# Una sola lectura; devuelve (id, repetida)
+def insert_reading(db: Session, row):
+    new, duplicates = split_duplicates(db, [row])
+    if duplicates:
+        return duplicates[0], True
+    try:
+        with db.begin_nested():
+            reading_id = db.execute(insert(SensorReading.__table__), row).inserted_primary_key[0]
+    except IntegrityError:
+        # Otro reintento la guardó entre la comprobación y el INSERT
+        reading_id = find_reading_id(db, row)
+        if reading_id is None:
+            raise
+        return reading_id, True
+    apply_rollups(db, new)
+    return reading_id, False
+
+
+def find_reading_id(db: Session, row):
+    return db.scalar(select(SensorReading.id).where(
+        SensorReading.device_id == row["device_id"], SensorReading.recorded_at == row["recorded_at"],
+    ))
+
+
+# Hook posterior al commit: actualiza la caché de últimas lecturas,
+# publica las lecturas a los clientes WebSocket/SSE y las recuerda para cortar reintentos
+def readings_committed(rows):
+    latest_readings.update(rows)
+    hub.publish(rows)
+    remember_readings(rows)
+
+
+def ingest_batch(db: Session, body: bytes, content_type: str, before_commit=None):
+    items = parse_batch_body(body, content_type)
+    rows, results, positions = validate_batch(items, db)
+
+    try:
+        new, duplicates = bulk_insert_readings(rows, db)
+        for position, reading_id in duplicates.items():
+            index = positions[position]
+            results[index] = {"index": index, "status": "duplicate", "id": reading_id}
+        response = {
+            "message": "Batch processed",
+            "accepted": len(new),
+            "duplicates": len(duplicates),
+            "rejected": len(results) - len(rows),
+            "results": results,
+        }
+        if before_commit:
+            before_commit(db, response)
+        db.commit()
+    except (HTTPException, IntegrityError):
+        # IntegrityError: otra petición guardó antes la misma Idempotency-Key
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Error saving data: {str(e)}")
+    readings_committed(new)
+    return response
@@ -0,0 +1,65 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select
+from models import Device, SensorReading
+from partitions import partition_scope
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+
+# El cursor es opaco para el cliente: base64 de (recorded_at, id) de la última fila
+def encode_cursor(recorded_at: datetime, reading_id: int) -> str:
+    raw = json.dumps([recorded_at.isoformat(), reading_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        recorded_at, reading_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(recorded_at), int(reading_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+# recorded_at se guarda en UTC sin zona: from/to con desfase se pasan a UTC antes de comparar
+def utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Filtros comunes de dispositivo, rango de tiempo y dueño sobre sensor_readings
+def apply_sensor_filters(stmt, device_id: Optional[int] = None, from_: Optional[datetime] = None, to: Optional[datetime] = None, owner_id: Optional[int] = None):
+    from_, to = utc_naive(from_), utc_naive(to)
+    if owner_id is not None:
+        stmt = stmt.where(SensorReading.device_id.in_(select(Device.id).where(Device.user_id == owner_id)))
+    if device_id is not None:
+        stmt = stmt.where(SensorReading.device_id == device_id)
+    if from_ is not None:
+        stmt = stmt.where(SensorReading.recorded_at >= from_)
+    if to is not None:
+        stmt = stmt.where(SensorReading.recorded_at < to)
+    return stmt
+
+
+# Página ordenada por (recorded_at, id) sin OFFSET: se continúa desde el cursor
+def sensor_page_query(columns, device_id=None, from_=None, to=None, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_LIMIT, owner_id: Optional[int] = None):
+    stmt = apply_sensor_filters(select(*columns), device_id, from_, to, owner_id)
+    if cursor:
+        last_recorded_at, last_id = decode_cursor(cursor)
+        stmt = stmt.where(or_(
+            SensorReading.recorded_at > last_recorded_at,
+            and_(SensorReading.recorded_at == last_recorded_at, SensorReading.id > last_id),
+        ))
+    # Se pide una fila extra para saber si hay página siguiente
+    stmt = stmt.order_by(SensorReading.recorded_at, SensorReading.id).limit(limit + 1)
+    return partition_scope(stmt, from_, to)
+
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(limit, MAX_PAGE_LIMIT))